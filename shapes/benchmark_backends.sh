@@ -0,0 +1,28 @@
+#!/bin/bash
+
+BINNING=shapes/binning.yaml
+ERA=$1
+CHANNELS=${@:2}
+
+source utils/setup_cvmfs_sft.sh
+source utils/setup_python.sh
+source utils/setup_samples.sh $ERA
+
+# Produce the nominal shapes with each backend on the same inputs
+for BACKEND in classic tdf columnar
+do
+    echo "[INFO] Run shape production with backend ${BACKEND}."
+    /usr/bin/time -v python shapes/produce_shapes_$ERA.py \
+        --directory $ARTUS_OUTPUTS \
+        --fake-factor-friend-directory $ARTUS_FRIENDS_FAKE_FACTOR \
+        --datasets $KAPPA_DATABASE \
+        --binning $BINNING \
+        --channels $CHANNELS \
+        --era $ERA \
+        --tag ${ERA}_benchmark_${BACKEND} \
+        --num-threads 32 \
+        --backend $BACKEND \
+        --skip-systematic-variations \
+        2> ${ERA}_benchmark_${BACKEND}_time.log
+    grep "Elapsed (wall clock)\|Maximum resident" ${ERA}_benchmark_${BACKEND}_time.log
+done
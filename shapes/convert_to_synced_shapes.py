@@ -6,6 +6,9 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True  # disable ROOT internal argument
 
 import argparse
 import os
+import yaml
+
+from production.rebinning import rebin_th1s
 
 import logging
 logger = logging.getLogger("")
@@ -32,6 +35,11 @@ def parse_arguments():
     parser.add_argument("era", type=str, help="Experiment era.")
     parser.add_argument("input", type=str, help="Path to single input ROOT file.")
     parser.add_argument("output", type=str, help="Path to output directory.")
+    parser.add_argument(
+        "--rebinning",
+        default=None,
+        type=str,
+        help="YAML file with target bin edges per channel and category in the section rebinning, applied to the fine master histograms.")
     return parser.parse_args()
 
 
@@ -71,6 +79,11 @@ def main(args):
             name_output += "_" + systematic
         hist_map[channel][category][name] = name_output
 
+    # Target binnings of the categories to be rebinned
+    rebinning = {}
+    if args.rebinning is not None:
+        rebinning = yaml.load(open(args.rebinning))["rebinning"]
+
     # Loop over map once and create respective output files
     for channel in hist_map:
         filename_output = os.path.join(
@@ -87,8 +100,13 @@ def main(args):
                 CHANNEL=channel, CATEGORY=category)
             file_output.mkdir(dir_name)
             file_output.cd(dir_name)
-            for name in hist_map[channel][category]:
-                hist = file_input.Get(name)
+            names = list(hist_map[channel][category])
+            hists = [file_input.Get(name) for name in names]
+            if category in rebinning.get(channel, {}):
+                logger.info("Rebin %d shapes of category %s_%s.", len(hists),
+                            channel, category)
+                hists = rebin_th1s(hists, rebinning[channel][category])
+            for name, hist in zip(names, hists):
                 name_output = hist_map[channel][category][name]
                 hist.SetTitle(name_output)
                 hist.SetName(name_output)
@@ -1,8 +1,10 @@
 #!/bin/bash
 
 ERA=$1
+REBINNING=$2
 
 source utils/setup_cvmfs_sft.sh
 source utils/setup_python.sh
 
-python shapes/convert_to_synced_shapes.py ${ERA} ${ERA}_signal_categories_shapes.root .
+python shapes/convert_to_synced_shapes.py ${ERA} ${ERA}_signal_categories_shapes.root . \
+    ${REBINNING:+--rebinning $REBINNING}
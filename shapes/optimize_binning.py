@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True  # disable ROOT internal argument parser
+
+import argparse
+import re
+import yaml
+
+import numpy as np
+
+from production.histograms import from_th1
+from production.rebinning import optimize
+
+import logging
+logger = logging.getLogger("")
+
+
+def setup_logging(output_file, level=logging.DEBUG):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    file_handler = logging.FileHandler(output_file, "w")
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Optimize the binning of the categories from fine master histograms of the shape producer."
+    )
+
+    parser.add_argument("input", type=str, help="Path to single input ROOT file.")
+    parser.add_argument(
+        "output",
+        type=str,
+        help="Path to output YAML file with the section rebinning as used by convert_to_synced_shapes.py.")
+    parser.add_argument(
+        "--min-yield",
+        default=1.0,
+        type=float,
+        help="Minimum background yield per bin.")
+    parser.add_argument(
+        "--max-uncertainty",
+        default=0.3,
+        type=float,
+        help="Maximum relative statistical uncertainty of the background per bin.")
+    parser.add_argument(
+        "--background-processes",
+        default="^(EMB|ZL|ZJ|TTL|TTJ|VVL|VVJ|W|QCDEMB)$",
+        type=str,
+        help="Regular expression matching the processes of one background model, which enter the yield and uncertainty requirements. Defaults to the model with embedded Z->tautau.")
+    parser.add_argument(
+        "--signal-processes",
+        default="^(ggH|bbH|qqH)",
+        type=str,
+        help="Regular expression matching the signal processes, which are not considered.")
+    parser.add_argument(
+        "--data-processes",
+        default="^data",
+        type=str,
+        help="Regular expression matching the data processes, which are not considered.")
+    return parser.parse_args()
+
+
+def main(args):
+    background = re.compile(args.background_processes)
+    signal = re.compile(args.signal_processes)
+    data = re.compile(args.data_processes)
+
+    # Collect the background templates of all categories
+    file_input = ROOT.TFile(args.input)
+    templates = {}
+    for key in file_input.GetListOfKeys():
+        name = key.GetName()
+        properties = [x for x in name.split("#") if not x == ""]
+        if not len(properties) in [7, 8]:
+            logger.critical(
+                "Shape {} has an unexpected number of properties.".format(
+                    name))
+            raise Exception
+        channel = properties[0]
+        category = properties[1].replace(properties[0] + "_", "", 1)
+        process = properties[2]
+        if category.endswith("_ss") or category.endswith("_B"):
+            continue
+        if signal.match(process) or data.match(process):
+            continue
+        edges, sumw, sumw2 = from_th1(file_input.Get(name))
+        # Alternative background models such as ZTT and EMB must not be
+        # added up, but all templates have to stay positive
+        templates.setdefault((channel, category), []).append(
+            (len(properties) == 7 and background.match(process) is not None,
+             edges, sumw, sumw2))
+    file_input.Close()
+
+    # Optimize all templates of a category at once
+    rebinning = {}
+    for (channel, category), entries in sorted(templates.items()):
+        edges = entries[0][1]
+        if any(len(entry[1]) != len(edges) for entry in entries):
+            logger.critical("Shapes of category %s_%s differ in binning.",
+                            channel, category)
+            raise Exception
+        sumw = np.array([entry[2] for entry in entries])
+        sumw2 = np.array([entry[3] for entry in entries])
+        model = np.array([entry[0] for entry in entries])
+        if not np.any(model):
+            logger.critical(
+                "Category %s_%s has no nominal shapes of the background processes.",
+                channel, category)
+            raise Exception
+        optimized = optimize(edges, sumw, sumw[model].sum(axis=0),
+                             sumw2[model].sum(axis=0), args.min_yield,
+                             args.max_uncertainty)
+        logger.info("Merged %d bins of category %s_%s with %d templates into %d bins.",
+                    len(edges) - 1, channel, category, len(entries),
+                    len(optimized) - 1)
+        rebinning.setdefault(channel, {})[category] = optimized
+
+    with open(args.output, "w") as f:
+        yaml.safe_dump({"rebinning": rebinning}, f, default_flow_style=None)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging("optimize_binning.log", logging.INFO)
+    main(args)
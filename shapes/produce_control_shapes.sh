@@ -20,4 +20,5 @@ python shapes/produce_shapes_$ERA.py \
     --era $ERA \
     --tag $ERA \
     --num-threads 32 \
-    --skip-systematic-variations True
+    --backend tdf \
+    --skip-systematic-variations
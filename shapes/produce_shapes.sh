@@ -3,6 +3,7 @@
 BINNING=shapes/binning.yaml
 ERA=$1
 CHANNELS=${@:2}
+SHAPE_CACHE_DIRECTORY=${SHAPE_CACHE_DIRECTORY:-$PWD/shape_cache}
 
 source utils/setup_cvmfs_sft.sh
 source utils/setup_python.sh
@@ -18,4 +19,7 @@ python shapes/produce_shapes_$ERA.py \
     --era $ERA \
     --tag ${ERA}_signal_categories \
     --num-threads 32 \
-#    --skip-systematic-variations True
+    --backend tdf \
+    ${RESUME:+--resume} \
+    --cache-directory $SHAPE_CACHE_DIRECTORY \
+#    --skip-systematic-variations
@@ -6,7 +6,7 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True  # disable ROOT internal argument
 ROOT.gErrorIgnoreLevel = ROOT.kError
 
 from shape_producer.cutstring import Cut, Cuts, Weight
-from shape_producer.systematics import Systematics, Systematic
+from shape_producer.systematics import Systematic
 from shape_producer.categories import Category
 from shape_producer.binning import ConstantBinning, VariableBinning
 from shape_producer.variable import Variable
@@ -15,6 +15,17 @@ from shape_producer.process import Process
 from shape_producer.estimation_methods import AddHistogramEstimationMethod
 from shape_producer.channel import ETMSSM2017, MTMSSM2017, TTMSSM2017
 
+from production.systematics import FusedSystematics
+from production import datasets
+from production import file_cache
+from production import friend_store
+from production import metadata
+from production import shards
+from production.rebinning import subdivide
+from production.unrolling import NDVariable
+from production.selection import Selection
+from production.registry import ProcessRegistry, SetupReport
+
 from itertools import product
 
 import argparse
@@ -55,6 +66,16 @@ def parse_arguments():
     )
     parser.add_argument(
         "--datasets", required=True, type=str, help="Kappa datsets database.")
+    parser.add_argument(
+        "--datasets-index-directory",
+        default=None,
+        type=str,
+        help="Directory of the index of the datasets database, which is rebuilt if the database changes. Defaults to the directory of the database.")
+    parser.add_argument(
+        "--metadata-cache",
+        default=None,
+        type=str,
+        help="File caching the trees, entries and generator weights of the input files. The entries serve the shard costs and the task splitting. Changed files are read again.")
     parser.add_argument(
         "--binning", required=True, type=str, help="Binning configuration.")
     parser.add_argument(
@@ -66,40 +87,176 @@ def parse_arguments():
     parser.add_argument("--era", type=str, help="Experiment era.")
     parser.add_argument("--control", action="store_true",
             help="Produce shapes for control plots.")
+    parser.add_argument(
+        "--fine-binning-factor",
+        default=1,
+        type=int,
+        help="Split each bin of the signal categories into this number of bins to store fine master histograms, which are rebinned by convert_to_synced_shapes.py.")
+    parser.add_argument(
+        "--signal-and-control",
+        action="store_true",
+        help="Produce the shapes of the signal categories and of the control plots in one run.")
     parser.add_argument(
         "--num-threads",
         default=32,
         type=int,
         help="Number of threads to be used.")
+    parser.add_argument(
+        "--num-processes",
+        default=1,
+        type=int,
+        help="Number of worker processes filling the histograms with the columnar backend.")
+    parser.add_argument(
+        "--task-size",
+        default=2000000,
+        type=int,
+        help="Maximum number of events filled by a single worker process task.")
     parser.add_argument(
         "--backend",
         default="classic",
-        choices=["classic", "tdf"],
+        choices=["classic", "tdf", "columnar"],
         type=str,
-        help="Backend. Use classic or tdf.")
+        help="Backend. Use classic, tdf or columnar. The tdf and columnar backends fill all histograms of a tree in a single event loop.")
+    parser.add_argument(
+        "--chunk-size",
+        default=500000,
+        type=int,
+        help="Number of events read at once by the columnar backend.")
+    parser.add_argument(
+        "--cache-directory",
+        default=None,
+        type=str,
+        help="Directory of the histogram cache. Histograms are only refilled if their inputs changed.")
+    parser.add_argument(
+        "--cache-size",
+        default=50.0,
+        type=float,
+        help="Maximum size of the histogram cache in GB.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted production of the fused backends from the checkpoint next to the output file.")
+    parser.add_argument(
+        "--histogram-memory",
+        default=4000.0,
+        type=float,
+        help="Maximum memory in MB of the histograms held at once by the fused backends, including the shared memory of the process pool. Larger productions are filled, estimated and written in batches, which read some trees more than once.")
+    parser.add_argument(
+        "--friend-store-directory",
+        default=None,
+        type=str,
+        help="Directory of the columnar store of the fake factors of the friend trees in the fake factor friend directory, read by the columnar backend instead of the friend trees.")
+    parser.add_argument(
+        "--file-cache-directory",
+        default=None,
+        type=str,
+        help="Node-local directory caching copies of the input files read by the fused backends, e.g. on a local SSD.")
+    parser.add_argument(
+        "--file-cache-size",
+        default=200.0,
+        type=float,
+        help="Maximum size of the file cache in GB.")
+    parser.add_argument(
+        "--prefetch-size",
+        default=0.0,
+        type=float,
+        help="Size in GB of the input files copied to the file cache ahead of the event loop reading them. Requires a file cache directory.")
+    parser.add_argument(
+        "--skim-directory",
+        default=None,
+        type=str,
+        help="Directory of the skims of the events passing the channel selections, read instead of the trees by the columnar backend.")
+    parser.add_argument(
+        "--shard",
+        default=None,
+        type=shards.parse_shard,
+        help="Produce only the shard i/N of the shapes, with 0 <= i < N, and write them to a partial output file.")
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="Merge the partial output files of all shards into the output file.")
     parser.add_argument(
         "--tag", default="ERA_CHANNEL", type=str, help="Tag of output files.")
     parser.add_argument(
         "--skip-systematic-variations",
-        default=False,
-        type=str,
+        action="store_true",
         help="Do not produce the systematic variations.")
+    for name, description in [("systematics", "systematic variations"),
+                              ("processes", "processes"),
+                              ("masses", "SUSY mass points"),
+                              ("categories", "categories")]:
+        parser.add_argument(
+            "--include-{}".format(name),
+            default=None,
+            nargs="+",
+            type=str,
+            help="Produce only {} matching any of these glob patterns, or regular expressions prefixed with re:.".format(description))
+        parser.add_argument(
+            "--exclude-{}".format(name),
+            default=None,
+            nargs="+",
+            type=str,
+            help="Do not produce {} matching any of these glob patterns, or regular expressions prefixed with re:.".format(description))
     return parser.parse_args()
 
 
+def category_variable(config, fine_binning_factor):
+    """Variable of a category, with several dimensions if configured."""
+    if "dimensions" in config:
+        return NDVariable(config["var"],
+                          [(d["expression"], d["bins"])
+                           for d in config["dimensions"]])
+    return Variable(config["var"],
+                    VariableBinning(subdivide(config["bins"], fine_binning_factor)),
+                    expression=config["expression"])
+
+
 def main(args):
+    if args.merge:
+        logger.info("Merge shards.")
+        shards.merge("{}_shapes.root".format(args.tag))
+        return
+
+    if args.metadata_cache is not None:
+        metadata.configure(args.metadata_cache, args.num_threads)
+    if args.friend_store_directory is not None:
+        if args.fake_factor_friend_directory is None:
+            logger.critical("The friend store requires a fake factor friend directory.")
+            raise Exception
+        friend_store.configure(args.friend_store_directory,
+                               args.fake_factor_friend_directory)
+    if args.file_cache_directory is not None:
+        file_cache.configure(args.file_cache_directory,
+                             args.file_cache_size * 1e9)
+
     # Container for all distributions to be drawn
     logger.info("Set up shape variations.")
-    systematics = Systematics(
+    setup_report = SetupReport()
+    systematics = FusedSystematics(
         "{}_shapes.root".format(args.tag),
         num_threads=args.num_threads,
-        skip_systematic_variations=args.skip_systematic_variations)
+        skip_systematic_variations=args.skip_systematic_variations,
+        backend=args.backend,
+        chunk_size=args.chunk_size,
+        num_processes=args.num_processes,
+        task_size=args.task_size,
+        cache_directory=args.cache_directory,
+        cache_size=args.cache_size * 1e9,
+        skim_directory=args.skim_directory,
+        prefetch_size=args.prefetch_size * 1e9,
+        memory_size=args.histogram_memory * 1e6,
+        resume=args.resume,
+        shard=args.shard,
+        processes=Selection(args.include_processes, args.exclude_processes),
+        categories=Selection(args.include_categories, args.exclude_categories),
+        variations=Selection(args.include_systematics, args.exclude_systematics))
 
     # Era selection
     if "2017" in args.era:
         from shape_producer.estimation_methods_Fall17 import DataEstimation, ZTTEstimation, ZTTEmbeddedEstimation, ZLEstimation, ZJEstimation, TTLEstimation, TTJEstimation, TTTEstimation, VVLEstimation, VVTEstimation, VVJEstimation, WEstimation, ggHEstimation, QCDEstimation_ABCD_TT_ISO2, QCDEstimation_SStoOS_MTETEM, FakeEstimationLT, NewFakeEstimationLT, FakeEstimationTT, NewFakeEstimationTT, SUSYggHEstimation, SUSYbbHEstimation
 
         from shape_producer.era import Run2017
+        datasets.enable(args.datasets_index_directory)
         era = Run2017(args.datasets)
 
     else:
@@ -111,90 +268,90 @@ def main(args):
     directory = args.directory
     ff_friend_directory = args.fake_factor_friend_directory
     susy_masses = ["80", "90", "100", "110", "120", "130", "140", "160", "180", "200", "250", "300", "350", "400", "450", "600", "700", "800", "900", "1200", "1400", "1500", "1600", "1800", "2000", "2300", "2600", "2900", "3200"]
+    mass_selection = Selection(args.include_masses, args.exclude_masses)
+    process_selection = Selection(args.include_processes, args.exclude_processes)
+    susy_masses = [m for m in susy_masses if mass_selection.matches(m)]
     mt = MTMSSM2017()
-    mt_processes = {
-        "data"  : Process("data_obs", DataEstimation      (era, directory, mt, friend_directory=[])),
-        "ZTT"   : Process("ZTT",      ZTTEstimation       (era, directory, mt, friend_directory=[])),
-        "EMB"   : Process("EMB",      ZTTEmbeddedEstimation  (era, directory, mt, friend_directory=[])),
-        "ZJ"    : Process("ZJ",       ZJEstimation        (era, directory, mt, friend_directory=[])),
-        "ZL"    : Process("ZL",       ZLEstimation        (era, directory, mt, friend_directory=[])),
-        "TTT"   : Process("TTT",      TTTEstimation       (era, directory, mt, friend_directory=[])),
-        "TTJ"   : Process("TTJ",      TTJEstimation       (era, directory, mt, friend_directory=[])),
-        "TTL"   : Process("TTL",      TTLEstimation       (era, directory, mt, friend_directory=[])),
-        "VVT"   : Process("VVT",      VVTEstimation       (era, directory, mt, friend_directory=[])),
-        "VVJ"   : Process("VVJ",      VVJEstimation       (era, directory, mt, friend_directory=[])),
-        "VVL"   : Process("VVL",      VVLEstimation       (era, directory, mt, friend_directory=[])),
-        "W"     : Process("W",        WEstimation         (era, directory, mt, friend_directory=[])),
-        #"FAKES" : Process("jetFakes", FakeEstimationLT    (era, directory, mt, friend_directory=[mt_friend_directory, ff_friend_directory])),
-        }
+    mt_processes = ProcessRegistry(process_selection)
+    mt_processes.register("data", lambda: Process("data_obs", DataEstimation      (era, directory, mt, friend_directory=[])), name="data_obs")
+    mt_processes.register("ZTT", lambda: Process("ZTT",      ZTTEstimation       (era, directory, mt, friend_directory=[])))
+    mt_processes.register("EMB", lambda: Process("EMB",      ZTTEmbeddedEstimation  (era, directory, mt, friend_directory=[])))
+    mt_processes.register("ZJ", lambda: Process("ZJ",       ZJEstimation        (era, directory, mt, friend_directory=[])))
+    mt_processes.register("ZL", lambda: Process("ZL",       ZLEstimation        (era, directory, mt, friend_directory=[])))
+    mt_processes.register("TTT", lambda: Process("TTT",      TTTEstimation       (era, directory, mt, friend_directory=[])))
+    mt_processes.register("TTJ", lambda: Process("TTJ",      TTJEstimation       (era, directory, mt, friend_directory=[])))
+    mt_processes.register("TTL", lambda: Process("TTL",      TTLEstimation       (era, directory, mt, friend_directory=[])))
+    mt_processes.register("VVT", lambda: Process("VVT",      VVTEstimation       (era, directory, mt, friend_directory=[])))
+    mt_processes.register("VVJ", lambda: Process("VVJ",      VVJEstimation       (era, directory, mt, friend_directory=[])))
+    mt_processes.register("VVL", lambda: Process("VVL",      VVLEstimation       (era, directory, mt, friend_directory=[])))
+    mt_processes.register("W", lambda: Process("W",        WEstimation         (era, directory, mt, friend_directory=[])))
+    #mt_processes.register("FAKES", lambda: Process("jetFakes", FakeEstimationLT    (era, directory, mt, friend_directory=[mt_friend_directory, ff_friend_directory])))
     #mt_processes["FAKES"] = Process("jetFakes", NewFakeEstimationLT(era, directory, mt, [mt_processes[process] for process in ["EMB", "ZL", "TTL", "VVL"]], mt_processes["data"], friend_directory=[mt_friend_directory, ff_friend_directory]))
     #mt_fakes_for_uncs=Process("jetFakes", FakeEstimationLT(era, directory, mt, friend_directory=[mt_friend_directory, ff_friend_directory]))
-    mt_processes["QCD"] = Process("QCD", QCDEstimation_SStoOS_MTETEM(era, directory, mt,
+    mt_processes.register("QCD", lambda: Process("QCD", QCDEstimation_SStoOS_MTETEM(era, directory, mt,
             [mt_processes[process] for process in ["ZTT", "ZL", "ZJ", "W", "TTT", "TTJ", "TTL", "VVT", "VVJ", "VVL"]],
-            mt_processes["data"], friend_directory=[], extrapolation_factor=1.00))
-    mt_processes["QCDEMB"] = Process("QCDEMB", QCDEstimation_SStoOS_MTETEM(era, directory, mt,
+            mt_processes["data"], friend_directory=[], extrapolation_factor=1.00)))
+    mt_processes.register("QCDEMB", lambda: Process("QCDEMB", QCDEstimation_SStoOS_MTETEM(era, directory, mt,
             [mt_processes[process] for process in ["EMB", "ZL", "ZJ", "W", "TTJ", "TTL", "VVJ", "VVL"]],
-            mt_processes["data"], friend_directory=[], extrapolation_factor=1.00))
+            mt_processes["data"], friend_directory=[], extrapolation_factor=1.00)))
     for m in susy_masses:
         if m != "160":
-            mt_processes["ggH"+m] = Process("ggH"+m, SUSYggHEstimation    (era, directory, mt, m, friend_directory=[])) 
-        mt_processes["bbH"+m] = Process("bbH"+m, SUSYbbHEstimation    (era, directory, mt, m, friend_directory=[])) 
+            mt_processes.register("ggH"+m, lambda m=m: Process("ggH"+m, SUSYggHEstimation    (era, directory, mt, m, friend_directory=[])))
+        mt_processes.register("bbH"+m, lambda m=m: Process("bbH"+m, SUSYbbHEstimation    (era, directory, mt, m, friend_directory=[])))
 
     et = ETMSSM2017()
-    et_processes = {
-        "data"  : Process("data_obs", DataEstimation      (era, directory, et, friend_directory=[])),
-        "ZTT"   : Process("ZTT",      ZTTEstimation       (era, directory, et, friend_directory=[])),
-        "EMB"   : Process("EMB",      ZTTEmbeddedEstimation  (era, directory, et, friend_directory=[])),
-        "ZJ"    : Process("ZJ",       ZJEstimation        (era, directory, et, friend_directory=[])),
-        "ZL"    : Process("ZL",       ZLEstimation        (era, directory, et, friend_directory=[])),
-        "TTT"   : Process("TTT",      TTTEstimation       (era, directory, et, friend_directory=[])),
-        "TTJ"   : Process("TTJ",      TTJEstimation       (era, directory, et, friend_directory=[])),
-        "TTL"   : Process("TTL",      TTLEstimation       (era, directory, et, friend_directory=[])),
-        "VVT"   : Process("VVT",      VVTEstimation       (era, directory, et, friend_directory=[])),
-        "VVJ"   : Process("VVJ",      VVJEstimation       (era, directory, et, friend_directory=[])),
-        "VVL"   : Process("VVL",      VVLEstimation       (era, directory, et, friend_directory=[])),
-        "W"     : Process("W",        WEstimation         (era, directory, et, friend_directory=[])),
-        #"FAKES" : Process("jetFakes", FakeEstimationLT    (era, directory, et, friend_directory=[et_friend_directory, ff_friend_directory])),
-        }
+    et_processes = ProcessRegistry(process_selection)
+    et_processes.register("data", lambda: Process("data_obs", DataEstimation      (era, directory, et, friend_directory=[])), name="data_obs")
+    et_processes.register("ZTT", lambda: Process("ZTT",      ZTTEstimation       (era, directory, et, friend_directory=[])))
+    et_processes.register("EMB", lambda: Process("EMB",      ZTTEmbeddedEstimation  (era, directory, et, friend_directory=[])))
+    et_processes.register("ZJ", lambda: Process("ZJ",       ZJEstimation        (era, directory, et, friend_directory=[])))
+    et_processes.register("ZL", lambda: Process("ZL",       ZLEstimation        (era, directory, et, friend_directory=[])))
+    et_processes.register("TTT", lambda: Process("TTT",      TTTEstimation       (era, directory, et, friend_directory=[])))
+    et_processes.register("TTJ", lambda: Process("TTJ",      TTJEstimation       (era, directory, et, friend_directory=[])))
+    et_processes.register("TTL", lambda: Process("TTL",      TTLEstimation       (era, directory, et, friend_directory=[])))
+    et_processes.register("VVT", lambda: Process("VVT",      VVTEstimation       (era, directory, et, friend_directory=[])))
+    et_processes.register("VVJ", lambda: Process("VVJ",      VVJEstimation       (era, directory, et, friend_directory=[])))
+    et_processes.register("VVL", lambda: Process("VVL",      VVLEstimation       (era, directory, et, friend_directory=[])))
+    et_processes.register("W", lambda: Process("W",        WEstimation         (era, directory, et, friend_directory=[])))
+    #et_processes.register("FAKES", lambda: Process("jetFakes", FakeEstimationLT    (era, directory, et, friend_directory=[et_friend_directory, ff_friend_directory])))
     #et_processes["FAKES"] = Process("jetFakes", NewFakeEstimationLT(era, directory, et, [et_processes[process] for process in ["EMB", "ZL", "TTL", "VVL"]], et_processes["data"], friend_directory=[et_friend_directory, ff_friend_directory]))
-    et_processes["QCD"] = Process("QCD", QCDEstimation_SStoOS_MTETEM(era, directory, et,
+    et_processes.register("QCD", lambda: Process("QCD", QCDEstimation_SStoOS_MTETEM(era, directory, et,
             [et_processes[process] for process in ["ZTT", "ZL", "ZJ", "W", "TTT", "TTJ", "TTL", "VVT", "VVJ", "VVL"]],
-            et_processes["data"], friend_directory=[], extrapolation_factor=1.00))
-    et_processes["QCDEMB"] = Process("QCDEMB", QCDEstimation_SStoOS_MTETEM(era, directory, et,
+            et_processes["data"], friend_directory=[], extrapolation_factor=1.00)))
+    et_processes.register("QCDEMB", lambda: Process("QCDEMB", QCDEstimation_SStoOS_MTETEM(era, directory, et,
             [et_processes[process] for process in ["EMB", "ZL", "ZJ", "W", "TTJ", "TTL", "VVJ", "VVL"]],
-            et_processes["data"], friend_directory=[], extrapolation_factor=1.00))
+            et_processes["data"], friend_directory=[], extrapolation_factor=1.00)))
     for m in susy_masses:
         if m != "160":
-            et_processes["ggH"+m] = Process("ggH"+m, SUSYggHEstimation    (era, directory, et, m, friend_directory=[])) 
-        et_processes["bbH"+m] = Process("bbH"+m, SUSYbbHEstimation    (era, directory, et, m, friend_directory=[])) 
+            et_processes.register("ggH"+m, lambda m=m: Process("ggH"+m, SUSYggHEstimation    (era, directory, et, m, friend_directory=[])))
+        et_processes.register("bbH"+m, lambda m=m: Process("bbH"+m, SUSYbbHEstimation    (era, directory, et, m, friend_directory=[])))
 
     tt = TTMSSM2017()
-    tt_processes = {
-        "data"  : Process("data_obs", DataEstimation      (era, directory, tt, friend_directory=[])),
-        "ZTT"   : Process("ZTT",      ZTTEstimation       (era, directory, tt, friend_directory=[])),
-        "EMB"   : Process("EMB",      ZTTEmbeddedEstimation  (era, directory, tt, friend_directory=[])),
-        "ZJ"    : Process("ZJ",       ZJEstimation        (era, directory, tt, friend_directory=[])),
-        "ZL"    : Process("ZL",       ZLEstimation        (era, directory, tt, friend_directory=[])),
-        "TTT"   : Process("TTT",      TTTEstimation       (era, directory, tt, friend_directory=[])),
-        "TTJ"   : Process("TTJ",      TTJEstimation       (era, directory, tt, friend_directory=[])),
-        "TTL"   : Process("TTL",      TTLEstimation       (era, directory, tt, friend_directory=[])),
-        "VVT"   : Process("VVT",      VVTEstimation       (era, directory, tt, friend_directory=[])),
-        "VVJ"   : Process("VVJ",      VVJEstimation       (era, directory, tt, friend_directory=[])),
-        "VVL"   : Process("VVL",      VVLEstimation       (era, directory, tt, friend_directory=[])),
-        "W"     : Process("W",        WEstimation         (era, directory, tt, friend_directory=[])),
-        #"FAKES" : Process("jetFakes", FakeEstimationTT    (era, directory, tt, friend_directory=[tt_friend_directory, ff_friend_directory])),
-        }
+    tt_processes = ProcessRegistry(process_selection)
+    tt_processes.register("data", lambda: Process("data_obs", DataEstimation      (era, directory, tt, friend_directory=[])), name="data_obs")
+    tt_processes.register("ZTT", lambda: Process("ZTT",      ZTTEstimation       (era, directory, tt, friend_directory=[])))
+    tt_processes.register("EMB", lambda: Process("EMB",      ZTTEmbeddedEstimation  (era, directory, tt, friend_directory=[])))
+    tt_processes.register("ZJ", lambda: Process("ZJ",       ZJEstimation        (era, directory, tt, friend_directory=[])))
+    tt_processes.register("ZL", lambda: Process("ZL",       ZLEstimation        (era, directory, tt, friend_directory=[])))
+    tt_processes.register("TTT", lambda: Process("TTT",      TTTEstimation       (era, directory, tt, friend_directory=[])))
+    tt_processes.register("TTJ", lambda: Process("TTJ",      TTJEstimation       (era, directory, tt, friend_directory=[])))
+    tt_processes.register("TTL", lambda: Process("TTL",      TTLEstimation       (era, directory, tt, friend_directory=[])))
+    tt_processes.register("VVT", lambda: Process("VVT",      VVTEstimation       (era, directory, tt, friend_directory=[])))
+    tt_processes.register("VVJ", lambda: Process("VVJ",      VVJEstimation       (era, directory, tt, friend_directory=[])))
+    tt_processes.register("VVL", lambda: Process("VVL",      VVLEstimation       (era, directory, tt, friend_directory=[])))
+    tt_processes.register("W", lambda: Process("W",        WEstimation         (era, directory, tt, friend_directory=[])))
+    #tt_processes.register("FAKES", lambda: Process("jetFakes", FakeEstimationTT    (era, directory, tt, friend_directory=[tt_friend_directory, ff_friend_directory])))
     #tt_processes["FAKES"] = Process("jetFakes", NewFakeEstimationTT(era, directory, tt, [tt_processes[process] for process in ["EMB", "ZL", "TTL", "VVL"]], tt_processes["data"], friend_directory=[tt_friend_directory, ff_friend_directory]))
-    tt_processes["QCD"] = Process("QCD", QCDEstimation_ABCD_TT_ISO2(era, directory, tt,
+    tt_processes.register("QCD", lambda: Process("QCD", QCDEstimation_ABCD_TT_ISO2(era, directory, tt,
             [tt_processes[process] for process in ["ZTT", "ZL", "ZJ", "W", "TTT", "TTJ", "TTL", "VVT", "VVJ", "VVL"]],
-            tt_processes["data"], friend_directory=[]))
-    tt_processes["QCDEMB"] = Process("QCDEMB", QCDEstimation_ABCD_TT_ISO2(era, directory, tt,
+            tt_processes["data"], friend_directory=[])))
+    tt_processes.register("QCDEMB", lambda: Process("QCDEMB", QCDEstimation_ABCD_TT_ISO2(era, directory, tt,
             [tt_processes[process] for process in ["EMB", "ZL", "ZJ", "W", "TTJ", "TTL", "VVJ", "VVL"]],
-            tt_processes["data"], friend_directory=[]))
+            tt_processes["data"], friend_directory=[])))
     for m in susy_masses:
         if m != "160":
-            tt_processes["ggH"+m] = Process("ggH"+m, SUSYggHEstimation    (era, directory, tt, m, friend_directory=[])) 
-        tt_processes["bbH"+m] = Process("bbH"+m, SUSYbbHEstimation    (era, directory, tt, m, friend_directory=[])) 
+            tt_processes.register("ggH"+m, lambda m=m: Process("ggH"+m, SUSYggHEstimation    (era, directory, tt, m, friend_directory=[])))
+        tt_processes.register("bbH"+m, lambda m=m: Process("bbH"+m, SUSYbbHEstimation    (era, directory, tt, m, friend_directory=[])))
 
     # Variables and categories
     binning = yaml.load(open(args.binning))
@@ -202,7 +359,7 @@ def main(args):
     et_categories = []
     # Analysis shapes
     if "et" in args.channels:
-        if args.control:
+        if args.control or args.signal_and_control:
             for variable in binning["control"]["et"]:
                 score = Variable(
                         variable,
@@ -218,15 +375,13 @@ def main(args):
                         et,
                         cuts,
                         variable=score))
-        else:
+        if not args.control or args.signal_and_control:
             for cat in binning["categories"]["et"]:
                 category = Category(
                             cat,
                             et,
                             Cuts(Cut(binning["categories"]["et"][cat]["cuts"], "category")),
-                            variable=Variable(binning["categories"]["et"][cat]["var"],
-                                VariableBinning(binning["categories"]["et"][cat]["bins"]),
-                                expression=binning["categories"]["et"][cat]["expression"]))
+                            variable=category_variable(binning["categories"]["et"][cat], args.fine_binning_factor))
                 # If category is ss wjets or qcd control region change sign cut
                 if "_qcd_" in cat or "_ss_" in cat:
                     category.cuts.remove("os")
@@ -235,7 +390,7 @@ def main(args):
 
     mt_categories = []
     if "mt" in args.channels:
-        if args.control:
+        if args.control or args.signal_and_control:
             for variable in binning["control"]["mt"]:
                 score = Variable(
                         variable,
@@ -251,16 +406,14 @@ def main(args):
                         mt,
                         cuts,
                         variable=score))
-        else:
+        if not args.control or args.signal_and_control:
             for cat in binning["categories"]["mt"]:
                 if cat == "nobtag_tight_qcd_cr":
                     category = Category(
                                 cat,
                                 mt,
                                 Cuts(Cut(binning["categories"]["mt"][cat]["cuts"], "category")),
-                                variable=Variable(binning["categories"]["mt"][cat]["var"],
-                                    VariableBinning(binning["categories"]["mt"][cat]["bins"]),
-                                    expression=binning["categories"]["mt"][cat]["expression"]))
+                                variable=category_variable(binning["categories"]["mt"][cat], args.fine_binning_factor))
                     # If category is ss wjets or qcd control region change sign cut
                     if "_qcd_" in cat or "_ss_" in cat:
                         category.cuts.remove("os")
@@ -269,7 +422,7 @@ def main(args):
 
     tt_categories = []
     if "tt" in args.channels:
-        if args.control:
+        if args.control or args.signal_and_control:
             for variable in binning["control"]["tt"]:
                 score = Variable(
                         variable,
@@ -285,16 +438,14 @@ def main(args):
                         tt,
                         cuts,
                         variable=score))
-        else:
+        if not args.control or args.signal_and_control:
             for cat in binning["categories"]["tt"]:
                 tt_categories.append(
                         Category(
                             cat,
                             tt,
                             Cuts(Cut(binning["categories"]["tt"][cat]["cuts"], "category")),
-                            variable=Variable(binning["categories"]["tt"][cat]["var"],
-                                VariableBinning(binning["categories"]["tt"][cat]["bins"]),
-                                expression=binning["categories"]["tt"][cat]["expression"])))
+                            variable=category_variable(binning["categories"]["tt"][cat], args.fine_binning_factor)))
         #if "et" in args.channels:
         #    classes_et = ["ggh", "qqh", "ztt", "zll", "w", "tt", "ss", "misc"]
         #    for i, label in enumerate(classes_et):
@@ -388,19 +539,19 @@ def main(args):
     for variation in tau_es_3prong_variations + tau_es_1prong_variations + tau_es_1prong1pizero_variations:
         for process_nick in ["ZTT", "TTT", "TTL", "VVL", "VVT"#, "FAKES"
                              ] + signal_nicks:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -418,19 +569,19 @@ def main(args):
     for variation in tau_es_3prong_variations + tau_es_1prong_variations + tau_es_1prong1pizero_variations:
         for process_nick in ["ZTT", "TTT", "TTL", "VVT", "VVL", "EMB"#, "FAKES"
                              ] + signal_nicks:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -463,19 +614,19 @@ def main(args):
                 "ZTT", "ZL", "ZJ", "W", "TTT", "TTL", "TTJ", "VVT", "VVJ",
                 "VVL"
         ] + signal_nicks:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -491,19 +642,19 @@ def main(args):
                 "ZTT", "ZL", "ZJ", "W", "TTT", "TTL", "TTJ", "VVT", "VVJ",
                 "VVL"
         ] + signal_nicks:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -520,19 +671,19 @@ def main(args):
     for variation in recoil_resolution_variations + recoil_response_variations:
         for process_nick in [
                 "ZTT", "ZL", "ZJ", "W"] + signal_nicks:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -544,19 +695,19 @@ def main(args):
         "CMS_htt_dyShape_Run2017", "zPtReweightWeight", SquareAndRemoveWeight)
     for variation in zpt_variations:
         for process_nick in ["ZTT", "ZL", "ZJ"]:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -569,19 +720,19 @@ def main(args):
         SquareAndRemoveWeight)
     for variation in top_pt_variations:
         for process_nick in ["TTT", "TTL", "TTJ"]:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -598,19 +749,19 @@ def main(args):
                   Weight("min(1.0+pt_2*0.002, 1.4)", "jetToTauFake_weight"), "Down"))
     for variation in jet_to_tau_fake_variations:
         for process_nick in ["ZJ", "TTJ", "W", "VVJ"]:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -626,7 +777,7 @@ def main(args):
         DifferentPipeline)
 
     if "et" in args.channels:
-        for process_nick in ["ZL"]:
+        for process_nick in [n for n in ["ZL"] if et_processes.selected(n)]:
             for variation in ele_fake_es_1prong_variations + ele_fake_es_1prong1pizero_variations:
                 systematics.add_systematic_variation(
                     variation=variation,
@@ -642,7 +793,7 @@ def main(args):
         DifferentPipeline)
 
     if "mt" in args.channels:
-        for process_nick in ["ZL"]:
+        for process_nick in [n for n in ["ZL"] if mt_processes.selected(n)]:
             for variation in mu_fake_es_1prong_variations + mu_fake_es_1prong1pizero_variations:
                 systematics.add_systematic_variation(
                     variation=variation,
@@ -668,7 +819,7 @@ def main(args):
         for process_nick in [
                 "ZTT", "ZL", "ZJ", "W", "TTT", "TTL", "TTJ", "VVL", "VVT", "VVJ"
         ] + signal_nicks:
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
@@ -689,7 +840,7 @@ def main(args):
                   Weight("(0.93*(pt_1<=25)+1.0*(pt_1>25))", "xtrg_mt_eff_weight"), "Down"))
     for variation in lep_trigger_eff_variations:
         for process_nick in ["EMB"]:
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
@@ -712,7 +863,7 @@ def main(args):
         for process_nick in [
                 "ZTT", "ZL", "ZJ", "W", "TTT", "TTL", "TTJ", "VVL", "VVT", "VVJ"
         ] + signal_nicks:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
@@ -733,7 +884,7 @@ def main(args):
                   Weight("(0.93*(pt_1<=28)+1.0*(pt_1>28))", "xtrg_et_eff_weight"), "Down"))
     for variation in lep_trigger_eff_variations:
         for process_nick in ["EMB"]:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
@@ -756,7 +907,7 @@ def main(args):
                 "eFakeTau_reweight"), "Down"))
     for variation in zll_et_weight_variations:
         for process_nick in ["ZL"]:
-            if "et" in [args.gof_channel] + args.channels:
+            if "et" in [args.gof_channel] + args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
@@ -777,7 +928,7 @@ def main(args):
                 "mFakeTau_reweight"), "Down"))
     for variation in zll_mt_weight_variations:
         for process_nick in ["ZL"]:
-            if "mt" in [args.gof_channel] + args.channels:
+            if "mt" in [args.gof_channel] + args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
@@ -794,19 +945,19 @@ def main(args):
                 "ZTT", "ZL", "ZJ", "W", "TTT", "TTL", "TTJ", "VVT", "VVJ",
                 "VVL"
         ] + signal_nicks:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -824,19 +975,19 @@ def main(args):
         DifferentPipeline)
     for variation in tau_es_3prong_variations + tau_es_1prong_variations + tau_es_1prong1pizero_variations:
         for process_nick in ["EMB"]:#, "FAKES"]:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
                     channel=et,
                     era=era)
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
                     channel=mt,
                     era=era)
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
@@ -866,7 +1017,7 @@ def main(args):
             "Down"))
     for variation in mt_decayMode_variations:
         for process_nick in ["EMB"]:
-            if "mt" in args.channels:
+            if "mt" in args.channels and mt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=mt_processes[process_nick],
@@ -895,7 +1046,7 @@ def main(args):
             "Down"))
     for variation in et_decayMode_variations:
         for process_nick in ["EMB"]:
-            if "et" in args.channels:
+            if "et" in args.channels and et_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=et_processes[process_nick],
@@ -924,26 +1075,19 @@ def main(args):
             "Down"))
     for variation in tt_decayMode_variations:
         for process_nick in ["EMB"]:
-            if "tt" in args.channels:
+            if "tt" in args.channels and tt_processes.selected(process_nick):
                 systematics.add_systematic_variation(
                     variation=variation,
                     process=tt_processes[process_nick],
                     channel=tt,
                     era=era)
     # 10% removed events in ttbar simulation (ttbar -> real tau tau events) will be added/subtracted to ZTT shape to use as systematic
-    tttautau_process_mt = Process(
-        "TTT",
-        TTTEstimation(
-            era, directory, mt, friend_directory=[]))
-    tttautau_process_et = Process(
-        "TTT",
-        TTTEstimation(
-            era, directory, et, friend_directory=[]))
-    tttautau_process_tt = Process(
-        "TTT",
-        TTTEstimation(
-            era, directory, tt, friend_directory=[]))
-    if 'mt' in args.channels:
+    if "mt" in args.channels and process_selection.matches(
+            "ZTTpTTTauTauDown", "ZTTpTTTauTauUp"):
+        tttautau_process_mt = Process(
+            "TTT",
+            TTTEstimation(
+                era, directory, mt, friend_directory=[]))
         for category in mt_categories:
             mt_processes['ZTTpTTTauTauDown'] = Process(
                 "ZTTpTTTauTauDown",
@@ -973,7 +1117,12 @@ def main(args):
                     variation=Relabel("CMS_htt_emb_ttbar", "Up"),
                     mass="125"))
 
-    if "et" in args.channels:
+    if "et" in args.channels and process_selection.matches(
+            "ZTTpTTTauTauDown", "ZTTpTTTauTauUp"):
+        tttautau_process_et = Process(
+            "TTT",
+            TTTEstimation(
+                era, directory, et, friend_directory=[]))
         for category in et_categories:
             et_processes["ZTTpTTTauTauDown"] = Process(
                 "ZTTpTTTauTauDown",
@@ -1002,7 +1151,12 @@ def main(args):
                     era=era,
                     variation=Relabel("CMS_htt_emb_ttbar", "Up"),
                     mass="125"))
-    if 'tt' in args.channels:
+    if "tt" in args.channels and process_selection.matches(
+            "ZTTpTTTauTauDown", "ZTTpTTTauTauUp"):
+        tttautau_process_tt = Process(
+            "TTT",
+            TTTEstimation(
+                era, directory, tt, friend_directory=[]))
         for category in tt_categories:
             tt_processes['ZTTpTTTauTauDown'] = Process(
                 "ZTTpTTTauTauDown",
@@ -1119,6 +1273,8 @@ def main(args):
     #            era=era)
 
     # Produce histograms
+    setup_report.log(systematics.num_systematics,
+                     [mt_processes, et_processes, tt_processes])
     logger.info("Start producing shapes.")
     systematics.produce()
     logger.info("Done producing shapes.")
@@ -1126,5 +1282,9 @@ def main(args):
 
 if __name__ == "__main__":
     args = parse_arguments()
-    setup_logging("{}_produce_shapes.log".format(args.tag), logging.INFO)
+    if args.shard is not None:
+        setup_logging("{}_produce_shapes_shard{}of{}.log".format(
+            args.tag, *args.shard), logging.INFO)
+    else:
+        setup_logging("{}_produce_shapes.log".format(args.tag), logging.INFO)
     main(args)
@@ -0,0 +1,39 @@
+#!/bin/bash
+
+BINNING=shapes/binning.yaml
+ERA=$1
+NUM_SHARDS=$2
+CHANNELS=${@:3}
+SHAPE_CACHE_DIRECTORY=${SHAPE_CACHE_DIRECTORY:-$PWD/shape_cache}
+
+source utils/setup_cvmfs_sft.sh
+source utils/setup_python.sh
+source utils/setup_samples.sh $ERA
+
+# Produce the shards as local processes, the same arguments with --shard can
+# be used in batch jobs
+for SHARD in $(seq 0 $((NUM_SHARDS - 1)))
+do
+    python shapes/produce_shapes_$ERA.py \
+        --directory $ARTUS_OUTPUTS \
+        --fake-factor-friend-directory $ARTUS_FRIENDS_FAKE_FACTOR \
+        --datasets $KAPPA_DATABASE \
+        --binning $BINNING \
+        --channels $CHANNELS \
+        --era $ERA \
+        --tag ${ERA}_signal_categories \
+        --num-threads 4 \
+        --backend tdf \
+        --cache-directory $SHAPE_CACHE_DIRECTORY \
+        --shard $SHARD/$NUM_SHARDS &
+done
+wait
+
+# Merge the shards into the shapes file of a single run
+python shapes/produce_shapes_$ERA.py \
+    --directory $ARTUS_OUTPUTS \
+    --datasets $KAPPA_DATABASE \
+    --binning $BINNING \
+    --era $ERA \
+    --tag ${ERA}_signal_categories \
+    --merge
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Helpers to schedule and fill the histograms of a shape production."""
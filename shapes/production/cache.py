@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed on-disk cache of filled histograms.
+
+A histogram is identified by everything that determines its content: the
+cut, weight and variable expressions, the binning, the pipeline and the
+paths, sizes and modification times of all input files. Entries are evicted
+least recently used first once the cache exceeds its size limit.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from . import histograms
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class HistogramCache(object):
+    def __init__(self, directory, max_size):
+        self._directory = directory
+        self._max_size = max_size
+        self._stats = {}
+        self._keys = {}
+        self._hits = 0
+        self._misses = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _file_stat(self, path):
+        if not path in self._stats:
+            stat = os.stat(path)
+            self._stats[path] = [path, stat.st_size, int(stat.st_mtime)]
+        return self._stats[path]
+
+    def key(self, group, request):
+        content = [
+            request.cut, request.weight, request.expression, request.edges,
+            group.folder, [self._file_stat(f) for f in group.inputfiles], [[
+                self._file_stat(f) for f in friend_inputfiles
+            ] for friend_inputfiles in group.friend_inputfiles]
+        ]
+        return hashlib.sha1(
+            json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key + ".npz")
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                content = np.load(f)
+                result = (content["edges"], content["sumw"], content["sumw2"],
+                          int(content["entries"]))
+            # The modification time marks the last usage for the eviction
+            os.utime(path, None)
+            return result
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def _store(self, key, edges, sumw, sumw2, entries):
+        path = self._path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass  # Created by a concurrent run
+        # Write to a temporary file first so that concurrent runs never read
+        # partially written entries
+        handle, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            np.savez(
+                f, edges=edges, sumw=sumw, sumw2=sumw2, entries=entries)
+        os.rename(temporary, path)
+
+    def lookup(self, groups):
+        """Take results from the cache and return the groups of missing requests."""
+        pending = []
+        for group in groups:
+            missing = []
+            for request in group.requests:
+                key = self.key(group, request)
+                cached = self._load(key)
+                if cached is None:
+                    self._keys[request] = key
+                    missing.append(request)
+                else:
+                    edges, sumw, sumw2, entries = cached
+                    request.set_result(
+                        histograms.create_th1(request.name, edges, sumw,
+                                              sumw2, entries))
+            self._hits += len(group.requests) - len(missing)
+            self._misses += len(missing)
+            if missing:
+                pending.append(group.subset(missing))
+        return pending
+
+    def update(self, groups):
+        """Store the results of the groups returned by lookup."""
+        for group in groups:
+            for request in group.requests:
+                edges, sumw, sumw2 = histograms.from_th1(request.result)
+                self._store(self._keys.pop(request), edges, sumw, sumw2,
+                            int(request.result.GetEntries()))
+
+    def evict(self):
+        entries = []
+        for directory, _, filenames in os.walk(self._directory):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for _, entry_size, path in sorted(entries):
+            if size <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # Removed by a concurrent run
+            size -= entry_size
+            removed += 1
+        logger.info("Histogram cache holds %.1f GB after evicting %d entries.",
+                    size / 1e9, removed)
+
+    def summary(self):
+        logger.info("Histogram cache: %d hits, %d misses.", self._hits,
+                    self._misses)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Journal of the shapes written by a production, used to resume it.
+
+Every written shape is stored as arrays in a directory next to the output
+file and recorded in an append-only journal. A resumed production skips the
+systematics with a valid journal entry and writes their stored shapes
+instead, so an interrupted production only loses the shapes in flight.
+
+An entry is valid if its stored arrays are intact and the systematic still
+has the same key. As for the histogram cache, the key consists of the cut,
+weight and variable expressions, the binning, the pipeline and the paths,
+sizes and modification times of all input files of its histograms.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from . import histograms
+from . import root_objects as ro
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _digest(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+class RestoredShape(object):
+    def __init__(self, name, result):
+        self.name = name
+        self._result = result
+
+    def save(self, root_file):
+        root_file.cd()
+        self._result.SetName(self.name)
+        self._result.Write()
+
+
+class RestoredSystematic(object):
+    """Systematic with a shape taken from the checkpoint."""
+
+    def __init__(self, name, result):
+        self.name = name
+        self.shape = RestoredShape(name, result)
+        self.root_objects = []
+
+
+class Checkpoint(object):
+    def __init__(self, output_file, resume=False):
+        self._directory = os.path.splitext(output_file)[0] + "_checkpoint"
+        self._journal = os.path.join(self._directory, "journal.jsonl")
+        self._entries = OrderedDict()
+        self._stats = {}
+        if resume:
+            self._load()
+        elif os.path.exists(self._directory):
+            shutil.rmtree(self._directory)
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+
+    def _path(self, name):
+        return os.path.join(self._directory,
+                            _digest(name.encode("utf-8")) + ".npz")
+
+    def _load(self):
+        if not os.path.exists(self._journal):
+            logger.info("No checkpoint found in %s, start from scratch.",
+                        self._directory)
+            return
+        invalid = 0
+        with open(self._journal) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # Last entry written while interrupted
+                try:
+                    with open(self._path(entry["name"]), "rb") as g:
+                        valid = _digest(g.read()) == entry["digest"]
+                except IOError:
+                    valid = False
+                if valid:
+                    self._entries[entry["name"]] = entry
+                else:
+                    invalid += 1
+        # Rewrite the journal without invalid and partially written entries,
+        # which new entries must not be appended to
+        handle, temporary = tempfile.mkstemp(
+            dir=self._directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.rename(temporary, self._journal)
+        logger.info("Found %d shapes in checkpoint %s, %d invalid.",
+                    len(self._entries), self._directory, invalid)
+
+    def _file_stat(self, path):
+        if not path in self._stats:
+            stat = os.stat(path)
+            self._stats[path] = [path, stat.st_size, int(stat.st_mtime)]
+        return self._stats[path]
+
+    def key(self, systematic):
+        content = [
+            [
+                ro.cut_string(r), ro.weight_string(r),
+                ro.variable_expression(r), ro.edges(r), ro.folder(r),
+                [self._file_stat(f) for f in ro.input_files(r)],
+                [[self._file_stat(f) for f in friend_files]
+                 for friend_files in ro.friend_files(r)]
+            ] for r in systematic.root_objects if ro.is_histogram(r)
+        ]
+        return _digest(json.dumps(content, sort_keys=True).encode("utf-8"))
+
+    def done(self, systematic):
+        """Whether the systematic has a valid entry with an up-to-date key."""
+        entry = self._entries.get(systematic.name)
+        return entry is not None and entry.get("key") == self.key(systematic)
+
+    def journaled(self, name):
+        return name in self._entries
+
+    def restore(self, name):
+        with open(self._path(name), "rb") as f:
+            content = np.load(f)
+            result = histograms.create_th1(
+                name, content["edges"], content["sumw"], content["sumw2"],
+                float(content["entries"]))
+        return RestoredSystematic(name, result)
+
+    def record(self, systematic):
+        """Store the written shape of a systematic and journal it."""
+        if isinstance(systematic, RestoredSystematic):
+            return
+        result = ro.shape_result(systematic.shape)
+        edges, sumw, sumw2 = histograms.from_th1(result)
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            edges=edges,
+            sumw=sumw,
+            sumw2=sumw2,
+            entries=result.GetEntries())
+        content = buffer.getvalue()
+        handle, temporary = tempfile.mkstemp(
+            dir=self._directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            f.write(content)
+        os.rename(temporary, self._path(systematic.name))
+        entry = {
+            "name": systematic.name,
+            "digest": _digest(content),
+            "key": self.key(systematic)
+        }
+        # The entry is on disk before the shape counts as done
+        with open(self._journal, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._entries[systematic.name] = entry
+
+    def remove(self):
+        """Remove the checkpoint of a completed production."""
+        shutil.rmtree(self._directory)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Fill a group of requests from NumPy arrays read in chunks of events."""
+
+import numpy as np
+
+from . import expressions
+from . import histograms
+from . import tree_reader
+from . import unrolling
+from .planner import Backend
+from .regions import families
+from .tree_reader import TreeReader
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Accumulator(object):
+    """Sum of weights, squared weights and entries of a histogram."""
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.sumw = np.zeros(len(edges) + 1)
+        self.sumw2 = np.zeros(len(edges) + 1)
+        self.entries = 0
+
+    def add(self, sumw, sumw2, entries):
+        self.sumw += sumw
+        self.sumw2 += sumw2
+        self.entries += entries
+
+    def fill(self, values, weights):
+        sumw, sumw2 = histograms.fill(self.edges, values, weights)
+        self.add(sumw, sumw2, len(values))
+
+
+class Atoms(object):
+    """Factors of the selections evaluated once per chunk of events.
+
+    Selections of different categories and processes share most of their
+    factors and are composed from the cached values, boolean factors as
+    bitwise conjunction of masks.
+    """
+
+    def __init__(self, columns, size):
+        self._columns = columns
+        self._size = size
+        self._values = {}
+
+    def value(self, factor):
+        if not factor in self._values:
+            value = expressions.compiled(factor).evaluate(
+                self._columns, self._size)
+            if expressions.is_boolean(expressions.parse(factor)):
+                value = value != 0
+            self._values[factor] = value
+        return self._values[factor]
+
+    def selection(self, factors):
+        """Product of the factors as in TTree::Draw."""
+        mask = None
+        product = None
+        for factor in factors:
+            value = self.value(factor)
+            if value.dtype == np.bool_:
+                mask = value if mask is None else mask & value
+            else:
+                product = value if product is None else product * value
+        if mask is None:
+            return np.ones(self._size) if product is None else product
+        if product is None:
+            return mask.astype(np.float64)
+        return np.where(mask, product, 0.0)
+
+
+class ColumnarBackend(Backend):
+    name = "columnar"
+
+    def __init__(self, chunk_size=500000, skim_directory=None):
+        self._chunk_size = chunk_size
+        self._skims = None
+        if skim_directory is not None:
+            from .skim import SkimStore
+            self._skims = SkimStore(skim_directory, chunk_size)
+
+    def fill(self, group):
+        accumulators = self.accumulate(group)
+        for request in group.requests:
+            accumulator = accumulators[request]
+            request.set_result(
+                histograms.create_th1(request.name, accumulator.edges,
+                                      accumulator.sumw, accumulator.sumw2,
+                                      accumulator.entries))
+
+    def _reader(self, group, branches):
+        if self._skims is not None:
+            return self._skims.reader(group, branches)
+        return TreeReader(group.inputfiles, group.folder,
+                          group.friend_inputfiles)
+
+    def _group_branches(self, region_families):
+        # Read only the branches used by any of the requests
+        branches = set()
+        for family in region_families:
+            branches |= self._branches(family)
+        return branches
+
+    def num_entries(self, group):
+        if self._skims is None:
+            return tree_reader.num_entries(group.inputfiles, group.folder)
+        return sum(
+            self._reader(group,
+                         self._group_branches(families(
+                             group.selections()))).num_entries())
+
+    def accumulate(self, group, start=0, stop=None):
+        """Fill the requests of a group into accumulators.
+
+        Only the entries from start to stop of the chain of input files, or
+        of the skim if one is used, are read if a range is given.
+        """
+        region_families = families(group.selections())
+        branches = self._group_branches(region_families)
+        accumulators = dict((request, Accumulator(request.edges))
+                            for request in group.requests)
+        reader = self._reader(group, branches)
+        for size, columns in reader.iterate(branches, self._chunk_size, start,
+                                            stop):
+            atoms = Atoms(columns, size)
+            for family in region_families:
+                self._fill_family(family, atoms, columns, accumulators)
+        return accumulators
+
+    def _branches(self, family, with_base=True):
+        branches = set()
+        expressions_used = list(family.base) if with_base else []
+        for region, requests in family.regions:
+            expressions_used += list(region)
+            for request in requests:
+                expressions_used += [request.weight, request.expression]
+        for expression in expressions_used:
+            branches |= expressions.branches(expression)
+        return branches
+
+    def _fill_family(self, family, atoms, columns, accumulators):
+        # As in TTree::Draw the value of the selection scales the weight
+        selection = atoms.selection(family.base)
+        mask = selection != 0
+        selected_size = int(np.count_nonzero(mask))
+        if selected_size == 0:
+            return
+
+        # Evaluate weights and variables only on the selected events and
+        # only once per distinct expression
+        selected = dict((name, columns[name][mask])
+                        for name in self._branches(family, with_base=False))
+        selection = selection[mask]
+        evaluated = {}
+        dimensions = dict((request.expression, request.dimensions)
+                          for _, requests in family.regions
+                          for request in requests if request.dimensions)
+
+        def evaluate(expression):
+            if not expression in evaluated:
+                if expression in dimensions:
+                    # Multi-dimensional variables are binned per dimension
+                    evaluated[expression] = unrolling.unrolled_values(
+                        dimensions[expression], selected, selected_size)
+                else:
+                    evaluated[expression] = expressions.compiled(
+                        expression).evaluate(selected, selected_size)
+            return evaluated[expression]
+
+        region_masks = [
+            atoms.selection(region)[mask] != 0 for region, _ in family.regions
+        ]
+        if len(region_masks) > 1 and np.all(
+                np.sum(region_masks, axis=0) <= 1):
+            self._fill_stacked(family, region_masks, selection, evaluate,
+                               accumulators)
+            return
+
+        for region_mask, (_, requests) in zip(region_masks, family.regions):
+            for request in requests:
+                weights = selection * evaluate(request.weight)
+                accumulators[request].fill(
+                    evaluate(request.expression)[region_mask],
+                    weights[region_mask])
+
+    def _fill_stacked(self, family, region_masks, selection, evaluate,
+                      accumulators):
+        """Fill all regions of disjoint region masks with one pass per shape."""
+        num_regions = len(region_masks)
+        region_index = np.full(len(selection), -1, dtype=np.int64)
+        for i, region_mask in enumerate(region_masks):
+            region_index[region_mask] = i
+        in_region = region_index >= 0
+        region_index = region_index[in_region]
+        entries = np.bincount(region_index, minlength=num_regions)
+
+        # Requests of different regions with the same variable, weight and
+        # binning are stacked into a single histogram
+        stacks = {}
+        for i, (_, requests) in enumerate(family.regions):
+            for request in requests:
+                key = (request.expression, request.weight,
+                       tuple(request.edges))
+                stacks.setdefault(key, []).append((i, request))
+        for (expression, weight, edges), members in stacks.items():
+            sumw, sumw2 = histograms.fill_stacked(
+                np.asarray(edges), region_index, num_regions,
+                evaluate(expression)[in_region],
+                (selection * evaluate(weight))[in_region])
+            for i, request in members:
+                accumulators[request].add(sumw[i], sumw2[i], entries[i])
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Indexed access to the Kappa datasets database.
+
+The eras of the shape-producer parse the full datasets.json at every start
+and the estimation methods query it with regular expressions over all
+entries. The parsed database and an index of it are stored as a binary
+sidecar, which is only rebuilt if the JSON file changes. The index holds the
+position of each nick and the datasets grouped by the fields the queries
+select on, such as the era, process and generator. Queries are evaluated
+once per group instead of once per dataset, and their results are memoized.
+"""
+
+import copy
+import json
+import os
+import pickle
+import tempfile
+
+import shape_producer.era as era_module
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Helper of the shape-producer and directory of the sidecars, set by enable
+_base = {}
+
+# Fields of the datasets selected by the queries of the estimation methods,
+# the era is given as campaign
+_INDEX_FIELDS = ("campaign", "data", "embedded", "energy", "extension",
+                 "generator", "process", "scenario", "tune")
+
+# Version of the sidecar layout, sidecars of other versions are rebuilt
+_VERSION = 2
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def _sidecar_path(database_path):
+    directory = _base.get("directory") or os.path.dirname(
+        os.path.abspath(database_path))
+    return os.path.join(directory,
+                        os.path.basename(database_path) + ".index.pkl")
+
+
+def _group(base_dict, fields):
+    """Nicks of the datasets grouped by their values of the given fields."""
+    groups = {}
+    for nick, entry in base_dict.items():
+        key = json.dumps([entry.get(f) for f in fields], sort_keys=True)
+        groups.setdefault(key, []).append(nick)
+    return list(groups.values())
+
+
+def _build_index(helper):
+    base_dict = getattr(helper, "base_dict", None)
+    if base_dict is None:
+        return None
+    return {
+        "positions": dict((nick, i) for i, nick in enumerate(base_dict)),
+        "groups": _group(base_dict, _INDEX_FIELDS)
+    }
+
+
+def _read_sidecar(path, database_path, stat):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            content = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError) as error:
+        logger.warning("Cannot read index %s of datasets database, rebuild it: %s",
+                       path, error)
+        return None
+    if content.get("version") != _VERSION or content.get(
+            "path") != os.path.abspath(database_path) or content.get(
+                "stat") != stat:
+        logger.info("Index %s of datasets database is outdated.", path)
+        return None
+    return content
+
+
+def _load(database_path):
+    """Helper of the shape-producer and its index, from an up-to-date sidecar."""
+    path = _sidecar_path(database_path)
+    stat = _stat(database_path)
+    content = _read_sidecar(path, database_path, stat)
+    if content is not None:
+        logger.debug("Load datasets database from %s.", path)
+        helper = _base["class"].__new__(_base["class"])
+        helper.__dict__.update(content["state"])
+        return helper, content["index"]
+
+    logger.info("Index datasets database %s.", database_path)
+    helper = _base["class"](database_path)
+    index = _build_index(helper)
+    try:
+        handle, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            pickle.dump({
+                "version": _VERSION,
+                "path": os.path.abspath(database_path),
+                "stat": stat,
+                "state": helper.__dict__,
+                "index": index
+            }, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, path)
+    except (IOError, OSError, pickle.PicklingError) as error:
+        logger.warning("Cannot write index of datasets database: %s", error)
+    return helper, index
+
+
+class IndexedDatasetsHelper(object):
+    """Datasets helper of the shape-producer with indexed queries."""
+
+    def __init__(self, database_path):
+        self._helper, self._index = _load(database_path)
+        self._groups = {}
+        self._queries = {}
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["_helper"], name)
+
+    def _group(self, fields):
+        """Datasets grouped by their values of the given fields."""
+        # Datasets agreeing in all indexed fields agree in any subset of them
+        if set(fields) <= set(_INDEX_FIELDS):
+            return self._index["groups"]
+        if not fields in self._groups:
+            self._groups[fields] = _group(self._helper.base_dict, fields)
+        return self._groups[fields]
+
+    def get_nicks_with_query(self, query):
+        key = json.dumps(query, sort_keys=True)
+        if not key in self._queries:
+            if self._index is None:
+                self._queries[key] = self._helper.get_nicks_with_query(query)
+            else:
+                self._queries[key] = self._query(query)
+        return list(self._queries[key])
+
+    def _query(self, query):
+        # Datasets with the same values of the queried fields give the same
+        # answer, so the helper is queried with one dataset per group
+        groups = self._group(tuple(sorted(query)))
+        base_dict = self._helper.base_dict
+        reduced = copy.copy(self._helper)
+        reduced.base_dict = dict(
+            (nicks[0], base_dict[nicks[0]]) for nicks in groups)
+        matched = set(reduced.get_nicks_with_query(query))
+        nicks = [n for ns in groups if ns[0] in matched for n in ns]
+        positions = self._index["positions"]
+        return sorted(nicks, key=lambda nick: positions[nick])
+
+
+def enable(directory=None):
+    """Let the eras of the shape-producer use the indexed datasets helper.
+
+    The sidecar is written to the given directory or next to the database.
+    """
+    if not "class" in _base:
+        helper_class = getattr(era_module, "datasetsHelperTwopz", None)
+        if helper_class is None:
+            logger.warning(
+                "The shape-producer does not use a known datasets helper, the database is not indexed."
+            )
+            return
+        _base["class"] = helper_class
+        era_module.datasetsHelperTwopz = IndexedDatasetsHelper
+    _base["directory"] = directory
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""Parser for the TTree::Draw expressions used in cuts, weights and variables.
+
+The expressions are parsed into a small syntax tree of tuples which can be
+compiled to NumPy array expressions and inspected for the branches they use.
+"""
+
+import re
+
+import numpy as np
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|
+        (?P<name>[A-Za-z_][A-Za-z0-9_]*(?:(?:::|\.)[A-Za-z_][A-Za-z0-9_]*)*)|
+        (?P<operator>&&|\|\||==|!=|<=|>=|[-+*/%<>!?:(),&|])
+    )""", re.VERBOSE)
+
+_BINARY_LEVELS = [
+    ["||"],
+    ["&&"],
+    ["|"],
+    ["&"],
+    ["==", "!="],
+    ["<", "<=", ">", ">="],
+    ["+", "-"],
+    ["*", "/", "%"],
+]
+
+_FUNCTIONS = {
+    "abs": "np.abs",
+    "fabs": "np.abs",
+    "TMath::Abs": "np.abs",
+    "sqrt": "np.sqrt",
+    "TMath::Sqrt": "np.sqrt",
+    "exp": "np.exp",
+    "TMath::Exp": "np.exp",
+    "log": "np.log",
+    "TMath::Log": "np.log",
+    "log10": "np.log10",
+    "TMath::Log10": "np.log10",
+    "pow": "np.power",
+    "TMath::Power": "np.power",
+    "sin": "np.sin",
+    "cos": "np.cos",
+    "tan": "np.tan",
+    "atan": "np.arctan",
+    "atan2": "np.arctan2",
+    "TMath::ATan2": "np.arctan2",
+    "sinh": "np.sinh",
+    "cosh": "np.cosh",
+    "tanh": "np.tanh",
+    "floor": "np.floor",
+    "ceil": "np.ceil",
+    "min": "np.minimum",
+    "TMath::Min": "np.minimum",
+    "max": "np.maximum",
+    "TMath::Max": "np.maximum",
+}
+
+_CONSTANTS = {"TMath::Pi": "np.pi", "true": "True", "false": "False"}
+
+_LOGICAL = {"||": "np.logical_or", "&&": "np.logical_and"}
+_BITWISE = {"|": "np.bitwise_or", "&": "np.bitwise_and"}
+_ARITHMETIC = {"+": "np.add", "-": "np.subtract", "*": "np.multiply"}
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError("Cannot tokenize expression '{}' at '{}'.".format(
+                expression, expression[position:]))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    def __init__(self, expression):
+        self._expression = expression
+        self._tokens = tokenize(expression)
+        self._position = 0
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self._position += 1
+        return token
+
+    def _expect(self, value):
+        token = self._next()
+        if token[1] != value:
+            raise ValueError("Expected '{}' in expression '{}'.".format(
+                value, self._expression))
+
+    def parse(self):
+        node = self._ternary()
+        if self._position != len(self._tokens):
+            raise ValueError("Unexpected token '{}' in expression '{}'.".format(
+                self._peek()[1], self._expression))
+        return node
+
+    def _ternary(self):
+        condition = self._binary(0)
+        if self._peek() == ("operator", "?"):
+            self._next()
+            if_true = self._ternary()
+            self._expect(":")
+            if_false = self._ternary()
+            return ("ternary", condition, if_true, if_false)
+        return condition
+
+    def _binary(self, level):
+        if level == len(_BINARY_LEVELS):
+            return self._unary()
+        node = self._binary(level + 1)
+        while True:
+            kind, value = self._peek()
+            if kind != "operator" or not value in _BINARY_LEVELS[level]:
+                return node
+            self._next()
+            node = ("binary", value, node, self._binary(level + 1))
+
+    def _unary(self):
+        kind, value = self._peek()
+        if kind == "operator" and value in ["!", "-", "+"]:
+            self._next()
+            return ("unary", value, self._unary())
+        return self._primary()
+
+    def _primary(self):
+        kind, value = self._next()
+        if kind == "number":
+            return ("number", value)
+        if kind == "name":
+            if self._peek() == ("operator", "("):
+                self._next()
+                arguments = []
+                if self._peek() != ("operator", ")"):
+                    arguments.append(self._ternary())
+                    while self._peek() == ("operator", ","):
+                        self._next()
+                        arguments.append(self._ternary())
+                self._expect(")")
+                return ("call", value, arguments)
+            if value in _CONSTANTS:
+                return ("constant", value)
+            return ("variable", value)
+        if value == "(":
+            node = self._ternary()
+            self._expect(")")
+            return node
+        raise ValueError("Unexpected token '{}' in expression '{}'.".format(
+            value, self._expression))
+
+
+_parsed = {}
+
+
+def parse(expression):
+    if not expression in _parsed:
+        _parsed[expression] = _Parser(expression).parse()
+    return _parsed[expression]
+
+
+def variables(node):
+    """Names of all branches used by a parsed expression."""
+    if node[0] == "variable":
+        return set([node[1]])
+    if node[0] == "call":
+        names = set()
+        for argument in node[2]:
+            names |= variables(argument)
+        return names
+    if node[0] in ["unary", "binary", "ternary"]:
+        names = set()
+        for child in node[1:]:
+            if isinstance(child, tuple):
+                names |= variables(child)
+        return names
+    return set()
+
+
+def branches(expression):
+    return variables(parse(expression))
+
+
+_COMPARISONS = ["==", "!=", "<", "<=", ">", ">=", "&&", "||"]
+
+
+def is_boolean(node):
+    """Whether a parsed expression evaluates to true or false only."""
+    if node[0] == "binary":
+        return node[1] in _COMPARISONS
+    if node[0] == "unary":
+        return node[1] == "!"
+    if node[0] == "constant":
+        return node[1] in ["true", "false"]
+    return False
+
+
+def to_string(node):
+    """Canonical, fully parenthesised string of a parsed expression."""
+    kind = node[0]
+    if kind in ["number", "constant", "variable"]:
+        return node[1]
+    if kind == "call":
+        return "{}({})".format(node[1],
+                               ", ".join(to_string(a) for a in node[2]))
+    if kind == "unary":
+        return "({}{})".format(node[1], to_string(node[2]))
+    if kind == "ternary":
+        return "({} ? {} : {})".format(*[to_string(n) for n in node[1:]])
+    return "({} {} {})".format(to_string(node[2]), node[1], to_string(node[3]))
+
+
+def factors(node):
+    """Split an expression into factors whose product is its value.
+
+    Products and logical conjunctions are flattened, operands of a
+    conjunction are converted to booleans to keep the value unchanged.
+    """
+    if node[0] == "binary" and node[1] == "*":
+        return factors(node[2]) + factors(node[3])
+    if node[0] == "binary" and node[1] == "&&":
+        return [
+            f if is_boolean(f) else ("binary", "!=", f, ("number", "0"))
+            for f in factors(node[2]) + factors(node[3])
+        ]
+    return [node]
+
+
+def atoms(expression):
+    """Canonical strings of the factors of an expression."""
+    return [to_string(factor) for factor in factors(parse(expression))]
+
+
+def to_numpy(node):
+    """Python source evaluating a parsed expression on the columns `c`."""
+    kind = node[0]
+    if kind == "number":
+        return node[1]
+    if kind == "constant":
+        return _CONSTANTS[node[1]]
+    if kind == "variable":
+        return "c[{!r}]".format(node[1])
+    if kind == "call":
+        if node[1] == "TMath::Pi":
+            return "np.pi"
+        if not node[1] in _FUNCTIONS:
+            raise ValueError("Function {} is not supported.".format(node[1]))
+        return "{}({})".format(_FUNCTIONS[node[1]],
+                               ", ".join(to_numpy(a) for a in node[2]))
+    if kind == "unary":
+        if node[1] == "!":
+            return "np.logical_not({})".format(to_numpy(node[2]))
+        if node[1] == "-":
+            return "np.negative({}, dtype=np.float64)".format(to_numpy(node[2]))
+        return "({}{})".format(node[1], to_numpy(node[2]))
+    if kind == "ternary":
+        return "np.where({}, {}, {})".format(*[to_numpy(n) for n in node[1:]])
+    operator, left, right = node[1], to_numpy(node[2]), to_numpy(node[3])
+    if operator in _LOGICAL:
+        return "{}({}, {})".format(_LOGICAL[operator], left, right)
+    if operator in _BITWISE:
+        return "{}(np.asarray({}, dtype=np.int64), np.asarray({}, dtype=np.int64))".format(
+            _BITWISE[operator], left, right)
+    # TTree::Draw evaluates all arithmetic in floating point
+    if operator == "/":
+        return "np.true_divide({}, {})".format(left, right)
+    # TTree::Draw casts the operands of the modulo to integers
+    if operator == "%":
+        integer = "np.trunc({}).astype(np.int64)"
+        return "np.fmod({}, {})".format(
+            integer.format(left), integer.format(right))
+    # Booleans count as 0 and 1, NumPy would add them as logical or
+    if operator in _ARITHMETIC:
+        return "{}({}, {}, dtype=np.float64)".format(_ARITHMETIC[operator], left,
+                                                     right)
+    return "({} {} {})".format(left, operator, right)
+
+
+class CompiledExpression(object):
+    """Expression evaluated as array operation on a dictionary of columns."""
+
+    def __init__(self, expression):
+        self._expression = expression
+        self._branches = branches(expression)
+        self._code = compile(
+            to_numpy(parse(expression)), "<{}>".format(expression), "eval")
+
+    @property
+    def expression(self):
+        return self._expression
+
+    @property
+    def branches(self):
+        return self._branches
+
+    def evaluate(self, columns, size):
+        result = eval(self._code, {"np": np}, {"c": columns})
+        # Constant expressions such as a weight of 1 are broadcast to the chunk
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), (size, ))
+
+
+_compiled = {}
+
+
+def compiled(expression):
+    if not expression in _compiled:
+        _compiled[expression] = CompiledExpression(expression)
+    return _compiled[expression]
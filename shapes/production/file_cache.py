@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Node-local read-through cache of the input files.
+
+Input files are copied to a local directory when they are opened by the
+backends and read from there in later runs. A copy is identified by the
+path, size and modification time of its source, so changed sources are
+copied again. Copies are evicted least recently used first once the cache
+exceeds its size limit, except for copies in use by the running process.
+Copies are in use from their first use until the backend releases them after
+the event loop. Files which do not fit next to the copies in use are read
+from their original location.
+
+A prefetcher copies the files of the upcoming event loops in a background
+thread, so that network reads overlap with the filling of histograms.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The cache shared by the producer, set by configure
+_shared = {}
+
+
+class FileCache(object):
+    def __init__(self, directory, max_size):
+        self._directory = directory
+        self._max_size = max_size
+        # Paths of the files in use and of prefetched files waiting for use
+        self._local_paths = {}
+        self._prefetched = set()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._prefetcher = None
+        # Counters are shared with forked worker processes
+        self._counts = multiprocessing.Array("d", 4)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _copy_path(self, path, stat):
+        key = hashlib.sha1("{}:{}:{}".format(
+            os.path.abspath(path), stat.st_size,
+            int(stat.st_mtime)).encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, key[:2],
+                            key + "_" + os.path.basename(path))
+
+    def _count(self, hit, size):
+        with self._counts.get_lock():
+            self._counts[0 if hit else 1] += 1
+            self._counts[2 if hit else 3] += size
+
+    def local_path(self, path):
+        """Path of the local copy of a file, copied on first use."""
+        local, _ = self._get(path)
+        with self._lock:
+            self._prefetched.discard(path)
+        if self._prefetcher is not None:
+            self._prefetcher.consumed(path)
+        return local
+
+    def prefetch(self, path):
+        """Copy a file if it is not cached and return the copied bytes."""
+        with self._lock:
+            if not path in self._local_paths:
+                self._prefetched.add(path)
+        return self._get(path)[1]
+
+    def release(self):
+        """Release the files used so far, which may be evicted afterwards."""
+        with self._lock:
+            self._local_paths = dict(
+                (path, local) for path, local in self._local_paths.items()
+                if path in self._prefetched)
+
+    def _get(self, path):
+        with self._lock:
+            if path in self._local_paths:
+                return self._local_paths[path], 0
+            event = self._pending.get(path)
+            if event is None:
+                self._pending[path] = threading.Event()
+        # Wait for a copy in progress in another thread
+        if event is not None:
+            event.wait()
+            return self._get(path)[0], 0
+        local, copied = self._localize(path)
+        with self._lock:
+            self._local_paths[path] = local
+            self._pending.pop(path).set()
+        return local, copied
+
+    def _localize(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, 0  # Not a file on a mounted file system
+        copy = self._copy_path(path, stat)
+        if os.path.exists(copy):
+            # The modification time marks the last usage for the eviction
+            try:
+                os.utime(copy, None)
+                self._count(True, stat.st_size)
+                return copy, 0
+            except OSError:
+                pass  # Evicted by a concurrent run
+        self._count(False, stat.st_size)
+        if stat.st_size > self._max_size or self.evict(
+                self._max_size - stat.st_size) > self._max_size - stat.st_size:
+            # The copies in use leave no room for the file
+            return path, 0
+        if not os.path.exists(os.path.dirname(copy)):
+            try:
+                os.makedirs(os.path.dirname(copy))
+            except OSError:
+                pass  # Created by a concurrent run
+        # Copy to a temporary file first so that concurrent runs never read
+        # partially written copies
+        temporary = None
+        try:
+            handle, temporary = tempfile.mkstemp(
+                dir=os.path.dirname(copy), suffix=".tmp")
+            os.close(handle)
+            shutil.copyfile(path, temporary)
+            os.rename(temporary, copy)
+        except (IOError, OSError) as error:
+            logger.warning("Cannot copy %s to the file cache: %s", path,
+                           error)
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+            return path, 0
+        return copy, stat.st_size
+
+    def evict(self, max_size=None):
+        max_size = self._max_size if max_size is None else max_size
+        with self._lock:
+            in_use = set(self._local_paths.values())
+        entries = []
+        for directory, _, filenames in os.walk(self._directory):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= max_size:
+                break
+            if path in in_use or path.endswith(".tmp"):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # Removed by a concurrent run
+            size -= entry_size
+        return size
+
+    def summary(self):
+        hits, misses, hit_bytes, miss_bytes = self._counts[:]
+        if hits + misses == 0:
+            return
+        logger.info(
+            "File cache: %d hits, %d misses, %.1f%% of %.1f GB read from local copies.",
+            hits, misses, 100.0 * hit_bytes / max(hit_bytes + miss_bytes, 1),
+            (hit_bytes + miss_bytes) / 1e9)
+
+
+    def start_prefetch(self, paths, max_size):
+        """Copy the given files in order ahead of their use."""
+        self._prefetcher = Prefetcher(self, paths, max_size)
+
+    def stop_prefetch(self):
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        with self._lock:
+            self._prefetched.clear()
+        self.release()
+
+
+class Prefetcher(object):
+    """Background thread copying files ahead of their use.
+
+    At most max_size bytes of copied files wait for their first use.
+    """
+
+    def __init__(self, cache, paths, max_size):
+        self._cache = cache
+        self._max_size = max_size
+        self._condition = threading.Condition()
+        self._ahead = {}
+        self._consumed = set()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(paths, ))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, paths):
+        for path in paths:
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            with self._condition:
+                while (self._ahead and
+                       sum(self._ahead.values()) + size > self._max_size
+                       and not self._stopped):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                if path in self._consumed:
+                    continue
+            copied = self._cache.prefetch(path)
+            with self._condition:
+                if copied > 0 and not path in self._consumed:
+                    self._ahead[path] = copied
+
+    def consumed(self, path):
+        with self._condition:
+            self._consumed.add(path)
+            if self._ahead.pop(path, None) is not None:
+                self._condition.notify_all()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+
+def configure(directory, max_size):
+    """Set up the cache used by the backends to open input files."""
+    _shared["cache"] = FileCache(directory, max_size)
+    return _shared["cache"]
+
+
+def shared():
+    """The shared cache or None if no cache is configured."""
+    return _shared.get("cache")
+
+
+def local_path(path):
+    """Path of the file to open, a local copy if the cache is configured."""
+    cache = shared()
+    return path if cache is None else cache.local_path(path)
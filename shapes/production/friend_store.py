@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped columnar store of the fake factors of friend trees.
+
+The fake factor friend trees hold one entry per entry of the corresponding
+Artus tree. On first use, the nominal and shifted fake factors of a friend
+tree are written once to one array per branch, which are then read instead
+of the friend tree. A store is identified by the path, size and modification
+time of the friend file and the pipeline, so changed friends are stored
+again.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+try:
+    import uproot
+except ImportError:
+    uproot = None
+
+from . import file_cache
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The store shared by the producer, set by configure
+_shared = {}
+
+
+class StoredTree(object):
+    """Arrays of a stored friend tree with the interface of an uproot tree.
+
+    Branches which are not stored are read from the friend tree itself.
+    """
+
+    def __init__(self, directory, content, path, folder):
+        self._directory = directory
+        self._stored = set(content["branches"])
+        self._other = content["other"]
+        self._path = path
+        self._folder = folder
+        self._arrays = {}
+        self.numentries = content["entries"]
+
+    def keys(self):
+        return sorted(self._stored) + self._other
+
+    def _array(self, branch):
+        if not branch in self._arrays:
+            self._arrays[branch] = np.load(
+                os.path.join(self._directory, branch + ".npy"), mmap_mode="r")
+        return self._arrays[branch]
+
+    def arrays(self, names, entrystart=None, entrystop=None, namedecode=None):
+        columns = dict((name, np.asarray(
+            self._array(name)[entrystart:entrystop]))
+                       for name in names if name in self._stored)
+        other = [name for name in names if not name in self._stored]
+        if other:
+            tree = uproot.open(file_cache.local_path(self._path))[self._folder]
+            columns.update(
+                tree.arrays(
+                    other,
+                    entrystart=entrystart,
+                    entrystop=entrystop,
+                    namedecode="utf-8"))
+        return columns
+
+
+class FriendStore(object):
+    def __init__(self, directory, friend_directory, patterns=("ff*", )):
+        self._directory = directory
+        self._friend_directory = os.path.abspath(friend_directory)
+        self._patterns = patterns
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def handles(self, path):
+        """Whether the file is a friend file read from the store."""
+        return os.path.abspath(path).startswith(
+            self._friend_directory + os.sep)
+
+    def _store_directory(self, path, folder):
+        stat = os.stat(path)
+        key = hashlib.sha1(
+            json.dumps([os.path.abspath(path), stat.st_size,
+                        int(stat.st_mtime), folder]).encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, key[:2], key)
+
+    def tree(self, path, folder):
+        """Stored tree of the pipeline of a friend file, stored on first use."""
+        directory = self._store_directory(path, folder)
+        content_path = os.path.join(directory, "store.json")
+        if not os.path.exists(content_path):
+            self._store(path, folder, directory)
+        with open(content_path) as f:
+            content = json.load(f)
+        return StoredTree(directory, content, path, folder)
+
+    def _store(self, path, folder, directory):
+        tree = uproot.open(file_cache.local_path(path))[folder]
+        names = [
+            key.decode("utf-8") if isinstance(key, bytes) else key
+            for key in tree.keys()
+        ]
+        stored = [
+            name for name in names
+            if any(fnmatch.fnmatchcase(name, p) for p in self._patterns)
+        ]
+        if not os.path.exists(os.path.dirname(directory)):
+            try:
+                os.makedirs(os.path.dirname(directory))
+            except OSError:
+                pass  # Created by a concurrent run
+        # Write to a temporary directory first so that concurrent runs never
+        # read partially written stores
+        temporary = tempfile.mkdtemp(dir=os.path.dirname(directory))
+        try:
+            arrays = tree.arrays(stored, namedecode="utf-8") if stored else {}
+            for name in stored:
+                np.save(os.path.join(temporary, name + ".npy"), arrays[name])
+            with open(os.path.join(temporary, "store.json"), "w") as f:
+                json.dump({
+                    "entries": int(tree.numentries),
+                    "branches": stored,
+                    "other": [n for n in names if not n in stored],
+                    "path": os.path.abspath(path),
+                    "folder": folder
+                }, f)
+            os.rename(temporary, directory)
+        except OSError:
+            if not os.path.exists(os.path.join(directory, "store.json")):
+                raise
+        finally:
+            if os.path.exists(temporary):
+                shutil.rmtree(temporary)
+        logger.info("Stored %d fake factor branches of %s/%s.", len(stored),
+                    path, folder)
+
+
+def configure(directory, friend_directory):
+    """Set up the store of the friend files in friend_directory."""
+    _shared["store"] = FriendStore(directory, friend_directory)
+    return _shared["store"]
+
+
+def open_tree(path, folder):
+    """Stored tree of a friend file, or None if it is not in a store."""
+    store = _shared.get("store")
+    if store is None or not store.handles(path):
+        return None
+    return store.tree(path, folder)
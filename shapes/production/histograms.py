@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Conversion between ROOT histograms and arrays of bin contents.
+
+Arrays always include the underflow and overflow bins, following the ROOT
+convention that bin 0 is the underflow and bin n+1 the overflow.
+"""
+
+from array import array
+
+import numpy as np
+
+import ROOT
+
+
+def bin_indices(edges, values):
+    """ROOT bin index of each value, including under- and overflow."""
+    return np.searchsorted(edges, values, side="right")
+
+
+def fill(edges, values, weights):
+    """Sum of weights and squared weights per bin."""
+    nbins = len(edges) + 1
+    indices = bin_indices(edges, values)
+    sumw = np.bincount(indices, weights=weights, minlength=nbins)
+    sumw2 = np.bincount(indices, weights=weights * weights, minlength=nbins)
+    return sumw, sumw2
+
+
+def fill_stacked(edges, regions, num_regions, values, weights):
+    """Sum of weights and squared weights per region and bin in one pass."""
+    nbins = len(edges) + 1
+    indices = regions * nbins + bin_indices(edges, values)
+    sumw = np.bincount(
+        indices, weights=weights, minlength=num_regions * nbins)
+    sumw2 = np.bincount(
+        indices, weights=weights * weights, minlength=num_regions * nbins)
+    return sumw.reshape(num_regions, nbins), sumw2.reshape(num_regions, nbins)
+
+
+def create_th1(name, edges, sumw, sumw2, entries=None):
+    hist = ROOT.TH1D(name, name, len(edges) - 1, array("d", edges))
+    hist.SetDirectory(0)
+    hist.Sumw2()
+    for i in range(len(edges) + 1):
+        hist.SetBinContent(i, sumw[i])
+        hist.SetBinError(i, np.sqrt(sumw2[i]))
+    if entries is not None:
+        hist.SetEntries(entries)
+    return hist
+
+
+def from_th1(hist):
+    """Bin edges, sum of weights and squared weights of a ROOT histogram."""
+    nbins = hist.GetNbinsX()
+    axis = hist.GetXaxis()
+    edges = np.array([axis.GetBinLowEdge(i) for i in range(1, nbins + 2)])
+    sumw = np.array([hist.GetBinContent(i) for i in range(nbins + 2)])
+    sumw2 = np.array([hist.GetBinError(i)**2 for i in range(nbins + 2)])
+    return edges, sumw, sumw2
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Cache of the metadata of the input files.
+
+For each file the size, modification time, the trees of all pipelines with
+their number of entries and the sum of generator weights of the nominal
+pipeline are stored. Files are revalidated by their size and modification
+time; changed and new files are read again in parallel. The entries serve
+the cost estimate of the shards and the splitting of event loops into tasks.
+The estimation methods of the shape-producer resolve their input files from
+the datasets database and do not read metadata of the files themselves.
+"""
+
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import tempfile
+import time
+
+import ROOT
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The cache shared by the producer, set by configure
+_shared = {}
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, None
+    return path, [stat.st_size, int(stat.st_mtime)]
+
+
+def _trees(directory, prefix=""):
+    trees = {}
+    for key in directory.GetListOfKeys():
+        name = prefix + key.GetName()
+        if key.GetClassName() == "TTree":
+            trees[name] = directory.Get(key.GetName())
+        elif key.GetClassName() == "TDirectoryFile":
+            trees.update(_trees(directory.Get(key.GetName()), name + "/"))
+    return trees
+
+
+def read(path):
+    """Metadata of a single file as dictionary."""
+    _, stat = _stat(path)
+    rootfile = ROOT.TFile.Open(path)
+    if not rootfile or rootfile.IsZombie():
+        logger.warning("Cannot open input file %s.", path)
+        return path, {"stat": stat, "entries": {}, "generator_weights": None}
+    trees = _trees(rootfile)
+    entries = dict((name, int(tree.GetEntries())) for name, tree in trees.items())
+    generator_weights = None
+    for name in sorted(trees):
+        tree = trees[name]
+        if "nominal" in name and tree.GetBranch("generatorWeight"):
+            hist = ROOT.TH1D("generator_weights", "", 1, -1.0, 1.0)
+            tree.Project("generator_weights", "0", "generatorWeight")
+            generator_weights = hist.GetSumOfWeights()
+            hist.Delete()
+            break
+    rootfile.Close()
+    return path, {
+        "stat": stat,
+        "entries": entries,
+        "generator_weights": generator_weights
+    }
+
+
+class MetadataCache(object):
+    def __init__(self, path, num_workers=1):
+        self._path = path
+        self._num_workers = max(num_workers, 1)
+        self._files = {}
+        self._validated = set()
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._files = json.load(f)["files"]
+            except (IOError, ValueError, KeyError):
+                logger.warning("Ignore corrupt metadata cache %s.", path)
+
+    def validate(self, paths):
+        """Revalidate the given files and read changed ones in parallel."""
+        start = time.time()
+        paths = sorted(set(paths) - self._validated)
+        if not paths:
+            return
+        # Stat calls wait for the file system and run in threads
+        pool = ThreadPool(self._num_workers)
+        stats = dict(pool.map(_stat, paths))
+        pool.close()
+        # Entries of caches without generator weights are read again
+        changed = [
+            path for path in paths if stats[path] is None or
+            not path in self._files or self._files[path]["stat"] != stats[path]
+            or not "generator_weights" in self._files[path]
+        ]
+        changed = [path for path in changed if stats[path] is not None]
+        if changed:
+            # ROOT is not thread-safe, files are read in worker processes
+            pool = multiprocessing.Pool(min(self._num_workers, len(changed)))
+            try:
+                self._files.update(dict(pool.map(read, changed)))
+                pool.close()
+            finally:
+                pool.join()
+            self.save()
+        self._validated.update(paths)
+        logger.info("Validated metadata of %d files in %.1f s, read %d changed files.",
+                    len(paths), time.time() - start, len(changed))
+
+    def _get(self, path):
+        if not path in self._validated:
+            self.validate([path])
+        if not path in self._files:
+            logger.critical("Input file %s does not exist.", path)
+            raise Exception
+        return self._files[path]
+
+    def entries(self, path, folder):
+        """Number of entries of the tree of a pipeline, 0 if missing."""
+        entries = self._get(path)["entries"]
+        if folder in entries:
+            return entries[folder]
+        # Pipelines are given as folder or as folder/tree
+        for name, value in entries.items():
+            if name.split("/")[0] == folder:
+                return value
+        return 0
+
+    def trees(self, path):
+        return sorted(self._get(path)["entries"])
+
+    def generator_weights(self, path):
+        """Sum of generator weights of the nominal pipeline or None."""
+        return self._get(path)["generator_weights"]
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self._path))
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as f:
+            json.dump({"files": self._files}, f)
+        os.rename(temporary, self._path)
+
+
+def configure(path, num_workers=1):
+    """Set up the cache shared by the producer."""
+    _shared["cache"] = MetadataCache(path, num_workers)
+    return _shared["cache"]
+
+
+def shared():
+    """The shared cache or None if no cache is configured."""
+    return _shared.get("cache")
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""Planning of the histogram filling.
+
+The planner collects the ROOT objects of all registered systematics and
+groups them by the tree they are read from. Each group is filled by a backend
+in a single pass over the events of this tree.
+"""
+
+import time
+
+from . import expressions
+from . import file_cache
+from . import pruning
+from . import root_objects as ro
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class FillRequest(object):
+    """A single histogram to be filled from a tree.
+
+    Identical histograms requested under different names, for example by
+    several systematics using the same pipeline, are filled once and copied
+    to all aliases.
+    """
+
+    def __init__(self, root_object):
+        self._root_object = root_object
+        self._aliases = []
+        self._name = root_object.name
+        self._cut = ro.cut_string(root_object)
+        self._weight = ro.weight_string(root_object)
+        self._expression = ro.variable_expression(root_object)
+        self._dimensions = ro.variable_dimensions(root_object)
+        self._edges = ro.edges(root_object)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def root_object(self):
+        return self._root_object
+
+    @property
+    def aliases(self):
+        return self._aliases
+
+    @property
+    def content(self):
+        return (self._cut, self._weight, self._expression, tuple(self._edges))
+
+    def add_alias(self, root_object):
+        self._aliases.append(root_object)
+
+    @property
+    def cut(self):
+        return self._cut
+
+    @property
+    def weight(self):
+        return self._weight
+
+    @property
+    def expression(self):
+        return self._expression
+
+    @property
+    def dimensions(self):
+        return self._dimensions
+
+    @property
+    def edges(self):
+        return self._edges
+
+    @property
+    def result(self):
+        return ro.result(self._root_object)
+
+    def set_result(self, result):
+        ro.set_result(self._root_object, result)
+        for alias in self._aliases:
+            hist = result.Clone(alias.name)
+            hist.SetDirectory(0)
+            ro.set_result(alias, hist)
+
+
+class FillGroup(object):
+    """All requests reading the same input files, pipeline and friend trees."""
+
+    def __init__(self, inputfiles, folder, friend_inputfiles):
+        self._inputfiles = inputfiles
+        self._folder = folder
+        self._friend_inputfiles = friend_inputfiles
+        self._requests = []
+        self._by_content = {}
+
+    @property
+    def key(self):
+        return (self._inputfiles, self._folder, self._friend_inputfiles)
+
+    @property
+    def inputfiles(self):
+        return self._inputfiles
+
+    @property
+    def folder(self):
+        return self._folder
+
+    @property
+    def friend_inputfiles(self):
+        return self._friend_inputfiles
+
+    @property
+    def requests(self):
+        return self._requests
+
+    def add(self, request):
+        """Add a request and return whether it duplicates an existing one."""
+        if request.content in self._by_content:
+            self._by_content[request.content].add_alias(request.root_object)
+            return True
+        self._by_content[request.content] = request
+        self._requests.append(request)
+        return False
+
+    def selections(self):
+        """Requests grouped by their cut string in order of first appearance.
+
+        Requests of the same selection differ only in weight or variable, for
+        example all weight-only variations of a process, and are filled from a
+        single evaluation of the selection.
+        """
+        selections = []
+        index = {}
+        for request in self._requests:
+            if not request.cut in index:
+                index[request.cut] = len(selections)
+                selections.append((request.cut, []))
+            selections[index[request.cut]][1].append(request)
+        return selections
+
+    def branches(self):
+        """Union of the branches used by the cuts, weights and variables."""
+        branches = set()
+        for request in self._requests:
+            for expression in [request.cut, request.weight, request.expression]:
+                branches |= expressions.branches(expression)
+        return branches
+
+    def subset(self, requests):
+        group = FillGroup(*self.key)
+        for request in requests:
+            group.add(request)
+        return group
+
+    def __str__(self):
+        return "{} ({} files, {} friend sets)".format(
+            self._folder, len(self._inputfiles), len(self._friend_inputfiles))
+
+
+class Backend(object):
+    """Interface of the backends filling the event loops of a plan."""
+
+    name = None
+
+    def fill(self, group):
+        raise NotImplementedError
+
+    def buffer_size(self, root_object):
+        """Bytes held by the backend for a histogram besides its result."""
+        return 0
+
+    def fill_all(self, groups):
+        files = file_cache.shared()
+        for i, group in enumerate(groups):
+            logger.debug("Fill event loop %d/%d over %s.", i + 1, len(groups),
+                         group)
+            self.fill(group)
+            # The files of the event loop are closed and may be evicted
+            if files is not None:
+                files.release()
+
+
+def group_key(root_object):
+    """Input files, pipeline and friend files of the tree of a histogram."""
+    return (ro.input_files(root_object), ro.folder(root_object),
+            ro.friend_files(root_object))
+
+
+class FillPlan(object):
+    """Groups the ROOT objects of a shape production by input tree."""
+
+    def __init__(self, root_objects):
+        self._groups = {}
+        self._standalone = []
+        self._duplicates = 0
+        for root_object in root_objects:
+            if not ro.is_histogram(root_object):
+                self._standalone.append(root_object)
+                continue
+            request = FillRequest(root_object)
+            key = group_key(root_object)
+            if not key in self._groups:
+                self._groups[key] = FillGroup(*key)
+            if self._groups[key].add(request):
+                self._duplicates += 1
+
+    @property
+    def groups(self):
+        # Sort by key to have a reproducible order of the event loops
+        return [self._groups[key] for key in sorted(self._groups)]
+
+    @property
+    def num_requests(self):
+        return sum(len(group.requests) for group in self._groups.values())
+
+    def summary(self):
+        logger.info(
+            "Planned %d histograms in %d event loops (%d objects produced standalone).",
+            self.num_requests, len(self._groups), len(self._standalone))
+        logger.info("Saved %d fills of histograms requested more than once.",
+                    self._duplicates)
+        for group in self.groups:
+            logger.debug(
+                "Event loop over %s fills %d histograms in %d selections.",
+                group, len(group.requests), len(group.selections()))
+
+    def fill(self, backend, cache=None, prefetch_size=0):
+        """Fill all groups with the backend.
+
+        Input files of groups still to be filled are copied ahead to the file
+        cache, if configured, up to prefetch_size bytes.
+        """
+        start = time.time()
+        groups = self.groups
+        if cache is not None:
+            groups = cache.lookup(groups)
+        pruning.report(groups)
+        files = file_cache.shared()
+        if files is not None and prefetch_size > 0:
+            files.start_prefetch(
+                [
+                    path for group in groups
+                    for i, inputfile in enumerate(group.inputfiles)
+                    for path in [inputfile] +
+                    [friends[i] for friends in group.friend_inputfiles]
+                ], prefetch_size)
+        try:
+            backend.fill_all(groups)
+        finally:
+            if files is not None:
+                files.stop_prefetch()
+        if cache is not None:
+            cache.update(groups)
+        for root_object in self._standalone:
+            ro.create_result(root_object)
+        logger.info("Filled %d histograms with backend %s in %.1f s.",
+                    self.num_requests, backend.name, time.time() - start)
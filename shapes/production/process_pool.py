@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Fill the event loops of a plan in a pool of worker processes.
+
+Large event loops are split into entry ranges, and the tasks are scheduled
+largest first. Workers write the sums of weights of their histograms into a
+shared-memory buffer, each task into its own slice. The parent reduces the
+slices in the order of the event loops and entry ranges, so the result does
+not depend on the order in which tasks finish.
+"""
+
+import multiprocessing
+import time
+
+import numpy as np
+
+from . import file_cache
+from . import histograms
+from . import root_objects as ro
+from . import tree_reader
+from .columnar_backend import Accumulator
+from .planner import Backend
+
+import logging
+logger = logging.getLogger(__name__)
+
+# State inherited by the forked workers, set only while a pool is running
+_state = {}
+
+
+def _slice_size(edges):
+    # Sum of weights and squared weights including under- and overflow and
+    # the number of entries
+    return 2 * (len(edges) + 1) + 1
+
+
+class _Task(object):
+    """An entry range of an event loop and the location of its histograms."""
+
+    def __init__(self, group, start, stop, offset):
+        self.group = group
+        self.start = start
+        self.stop = stop
+        self.offsets = []
+        for request in group.requests:
+            self.offsets.append((request, offset))
+            offset += _slice_size(request.edges)
+        self.end = offset
+
+    @property
+    def num_entries(self):
+        return self.stop - self.start
+
+    def __str__(self):
+        return "{} [{}, {})".format(self.group, self.start, self.stop)
+
+
+def _fill_task(index):
+    start = time.time()
+    task = _state["tasks"][index]
+    accumulators = _state["backend"].accumulate(task.group, task.start,
+                                                task.stop)
+    if file_cache.shared() is not None:
+        file_cache.shared().release()
+    buffer = np.frombuffer(_state["buffer"], dtype=np.float64)
+    for request, offset in task.offsets:
+        accumulator = accumulators[request]
+        nbins = len(accumulator.sumw)
+        buffer[offset:offset + nbins] = accumulator.sumw
+        buffer[offset + nbins:offset + 2 * nbins] = accumulator.sumw2
+        buffer[offset + 2 * nbins] = accumulator.entries
+    return index, time.time() - start
+
+
+class ProcessPoolBackend(Backend):
+    def __init__(self, backend, num_processes, task_size=2000000):
+        self._backend = backend
+        self._num_processes = num_processes
+        self._task_size = task_size
+        self._entries = {}
+        self.name = "{} ({} processes)".format(backend.name, num_processes)
+
+    def fill(self, group):
+        self.fill_all([group])
+
+    def buffer_size(self, root_object):
+        """Bytes of the shared buffer of a histogram, one slice per task.
+
+        The entries of the trees are an upper bound for those of skims.
+        """
+        key = (ro.input_files(root_object), ro.folder(root_object))
+        if not key in self._entries:
+            self._entries[key] = tree_reader.num_entries(*key)
+        num_tasks = max(-(-self._entries[key] // self._task_size), 1)
+        return 8 * _slice_size(ro.edges(root_object)) * num_tasks
+
+    def _tasks(self, groups):
+        tasks = []
+        offset = 0
+        for group in groups:
+            num_entries = self._backend.num_entries(group)
+            # Empty trees still need a task to produce empty histograms
+            for start in range(0, max(num_entries, 1), self._task_size):
+                tasks.append(
+                    _Task(group, start, min(start + self._task_size,
+                                            num_entries), offset))
+                offset = tasks[-1].end
+        return tasks, offset
+
+    def fill_all(self, groups):
+        tasks, size = self._tasks(groups)
+        if file_cache.shared() is not None:
+            file_cache.shared().release()
+        if not tasks:
+            return
+        logger.info("Split %d event loops into %d tasks of up to %d events.",
+                    len(groups), len(tasks), self._task_size)
+
+        # Schedule the largest tasks first to avoid a long tail at the end
+        order = sorted(
+            range(len(tasks)),
+            key=lambda i: (-tasks[i].num_entries * len(tasks[i].offsets), i))
+        durations = [None] * len(tasks)
+
+        # The buffer and the tasks have to exist before the workers are forked
+        shared = multiprocessing.RawArray("d", size)
+        _state.update(backend=self._backend, tasks=tasks, buffer=shared)
+        pool = multiprocessing.Pool(self._num_processes)
+        try:
+            for i, (index, duration) in enumerate(
+                    pool.imap_unordered(_fill_task, order)):
+                durations[index] = duration
+                logger.debug("Filled task %d/%d over %s in %.1f s.", i + 1,
+                             len(tasks), tasks[index], duration)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _state.clear()
+        self._report(tasks, durations)
+        self._reduce(tasks, np.frombuffer(shared, dtype=np.float64))
+
+    def _report(self, tasks, durations):
+        logger.info(
+            "Task durations: min %.1f s, median %.1f s, max %.1f s, total %.1f s.",
+            min(durations), float(np.median(durations)), max(durations),
+            sum(durations))
+        slowest = sorted(
+            range(len(tasks)), key=lambda i: durations[i], reverse=True)[:10]
+        for i in slowest:
+            logger.info("Task %s with %d events and %d histograms took %.1f s.",
+                        tasks[i], tasks[i].num_entries, len(tasks[i].offsets),
+                        durations[i])
+
+    def _reduce(self, tasks, buffer):
+        accumulators = {}
+        order = []
+        for task in tasks:
+            for request, offset in task.offsets:
+                if not request in accumulators:
+                    accumulators[request] = Accumulator(request.edges)
+                    order.append(request)
+                nbins = len(request.edges) + 1
+                accumulators[request].add(
+                    buffer[offset:offset + nbins],
+                    buffer[offset + nbins:offset + 2 * nbins],
+                    int(buffer[offset + 2 * nbins]))
+        for request in order:
+            accumulator = accumulators[request]
+            request.set_result(
+                histograms.create_th1(request.name, accumulator.edges,
+                                      accumulator.sumw, accumulator.sumw2,
+                                      accumulator.entries))
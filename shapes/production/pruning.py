@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Reading only the branches used by the requests of an event loop.
+
+The Artus trees hold hundreds of branches of which a production uses only a
+few dozen. The report compares the compressed size of the full trees with
+the size of the branches which are actually read.
+"""
+
+import ROOT
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def used_branches(group):
+    """Branches of a group or None if an expression cannot be analysed."""
+    try:
+        return group.branches()
+    except ValueError as error:
+        logger.warning("Cannot prune branches of %s: %s", group, error)
+        return None
+
+
+def prune(chain, branches):
+    """Disable all branches of a chain which are not used."""
+    chain.LoadTree(0)
+    available = [b.GetName() for b in chain.GetListOfBranches() or []]
+    chain.SetBranchStatus("*", 0)
+    for branch in available:
+        if branch in branches:
+            chain.SetBranchStatus(branch, 1)
+
+
+def _file_bytes(path, folders):
+    """Compressed bytes of the trees of a file and of their used branches.
+
+    The used branches are given per folder, None for all branches.
+    """
+    rootfile = ROOT.TFile.Open(path)
+    if not rootfile:
+        logger.warning("Cannot open %s.", path)
+        return {}
+    result = {}
+    for folder, branches in folders.items():
+        tree = rootfile.Get(folder)
+        if not tree:
+            logger.warning("Cannot read tree %s of %s.", folder, path)
+            continue
+        total = tree.GetZipBytes()
+        used = total
+        if branches is not None:
+            used = sum(
+                branch.GetZipBytes("*") for branch in tree.GetListOfBranches()
+                if branch.GetName() in branches)
+        result[folder] = (total, used)
+    rootfile.Close()
+    return result
+
+
+def report(groups):
+    """Log the bytes read per tree before and after pruning.
+
+    Only the given groups are reported, which are the ones actually filled.
+    """
+    # Event loops over the same tree together read the union of branches
+    files = {}
+    for group in groups:
+        used = used_branches(group)
+        for inputfiles in [group.inputfiles] + list(group.friend_inputfiles):
+            for path in inputfiles:
+                folders = files.setdefault(path, {})
+                if used is None or (group.folder in folders
+                                    and folders[group.folder] is None):
+                    folders[group.folder] = None
+                else:
+                    folders[group.folder] = folders.get(group.folder,
+                                                        set()) | used
+    if not files:
+        return
+    total = 0
+    pruned = 0
+    num_trees = 0
+    # Each file is opened once for all its trees
+    for path, folders in sorted(files.items()):
+        for folder, (tree_total, tree_pruned) in sorted(
+                _file_bytes(path, folders).items()):
+            logger.debug("Read %.1f MB instead of %.1f MB of %s/%s.",
+                         tree_pruned / 1e6, tree_total / 1e6, path, folder)
+            total += tree_total
+            pruned += tree_pruned
+            num_trees += 1
+    logger.info("Branch pruning reads %.1f GB instead of %.1f GB of %d trees.",
+                pruned / 1e9, total / 1e9, num_trees)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Rebinning of fine master histograms to coarser target binnings.
+
+The bin contents of many histograms with the same binning are stacked into
+one array and summed over the target bins in a single operation. Bins of
+the master histogram below and above the target range are added to the
+underflow and overflow bins.
+"""
+
+import numpy as np
+
+from . import histograms
+
+
+def subdivide(edges, factor):
+    """Split each bin into factor bins of equal width."""
+    edges = np.asarray(edges, dtype=np.float64)
+    if factor == 1:
+        return [float(edge) for edge in edges]
+    fine = [
+        np.linspace(low, high, factor + 1)[:-1]
+        for low, high in zip(edges[:-1], edges[1:])
+    ]
+    return [float(edge) for edge in np.concatenate(fine + [edges[-1:]])]
+
+
+def target_indices(edges, target):
+    """Indices of the target edges in the master edges."""
+    edges = np.asarray(edges, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    indices = np.clip(np.searchsorted(edges, target), 0, len(edges) - 1)
+    # Edges are compared with a tolerance to allow for rounding in the subdivision
+    closest = np.where(
+        np.abs(edges[indices - 1] - target) < np.abs(edges[indices] - target),
+        indices - 1, indices)
+    if not np.allclose(edges[closest], target, rtol=1e-9, atol=1e-9):
+        raise ValueError(
+            "Target binning {} is not a subset of the master binning.".format(
+                list(target)))
+    if np.any(np.diff(closest) <= 0):
+        raise ValueError("Target binning {} is not increasing.".format(
+            list(target)))
+    return closest
+
+
+def rebin(edges, contents, target):
+    """Sum the bin contents of stacked histograms into the target bins.
+
+    The contents have the shape (histograms, bins) and include the underflow
+    and overflow bins.
+    """
+    indices = target_indices(edges, target)
+    starts = np.concatenate([[0], indices + 1])
+    return np.add.reduceat(np.atleast_2d(contents), starts, axis=1)
+
+
+def rebin_th1s(hists, target):
+    """Rebinned copies of ROOT histograms sharing the same master binning."""
+    if not hists:
+        return []
+    converted = [histograms.from_th1(hist) for hist in hists]
+    edges = converted[0][0]
+    for hist, (hist_edges, _, _) in zip(hists, converted):
+        if len(hist_edges) != len(edges) or not np.allclose(hist_edges, edges):
+            raise ValueError("Histogram {} has a different binning.".format(
+                hist.GetName()))
+    sumw = rebin(edges, np.array([c[1] for c in converted]), target)
+    sumw2 = rebin(edges, np.array([c[2] for c in converted]), target)
+    return [
+        histograms.create_th1(hist.GetName(), target, sumw[i], sumw2[i],
+                              hist.GetEntries())
+        for i, hist in enumerate(hists)
+    ]
+
+
+def _cumulative(contents):
+    # Cumulative sums over the bins starting at 0
+    contents = np.atleast_2d(contents)
+    return np.concatenate(
+        [np.zeros((len(contents), 1)),
+         np.cumsum(contents, axis=1)], axis=1)
+
+
+def optimize(edges, templates, background, background_sumw2, min_yield,
+             max_uncertainty):
+    """Merge bins until all of them fulfil the statistical requirements.
+
+    Each merged bin has a background yield of at least min_yield, a relative
+    statistical uncertainty of the background of at most max_uncertainty and
+    a positive content in every template with any content in the range.
+    Starting from the upper end, the narrowest valid bin is chosen for all
+    candidate lower edges at once. Remaining bins at the lower end, which do
+    not form a valid bin, are merged into the lowest valid bin.
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    templates = np.atleast_2d(templates)[:, 1:-1]
+    scale = np.abs(templates).sum(axis=1)
+    templates = templates[scale > 0]
+    # Sums of zeros must not appear as positive due to rounding
+    tolerance = 1e-9 * scale[scale > 0][:, None]
+    cumulative = _cumulative(templates)
+    yields = _cumulative(np.asarray(background)[1:-1])[0]
+    sumw2 = _cumulative(np.asarray(background_sumw2)[1:-1])[0]
+
+    indices = [len(edges) - 1]
+    upper = indices[0]
+    while upper > 0:
+        bin_yields = yields[upper] - yields[:upper]
+        bin_sumw2 = sumw2[upper] - sumw2[:upper]
+        contents = cumulative[:, upper][:, None] - cumulative[:, :upper]
+        valid = (bin_yields >= min_yield) & (
+            np.sqrt(np.maximum(bin_sumw2, 0.0)) <=
+            max_uncertainty * bin_yields) & np.all(
+                contents > tolerance, axis=0)
+        candidates = np.nonzero(valid)[0]
+        if len(candidates) == 0:
+            break
+        upper = candidates[-1]
+        indices.append(upper)
+    if indices[-1] != 0:
+        if len(indices) > 1:
+            indices[-1] = 0
+        else:
+            indices.append(0)
+    return [float(edge) for edge in edges[sorted(indices)]]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Grouping of selections which differ only in sign and isolation requirements.
+
+The QCD estimations request the same samples in the opposite- and same-sign
+regions and, for the tt channel, in isolated and anti-isolated regions. Such
+selections share all other factors of their cut strings and are filled
+together, using a region index per event.
+"""
+
+import re
+
+from . import expressions
+
+_REGION_BRANCH = re.compile(r"^(q_[12]|iso_[12]|by\w*Isolation\w*_[12])$")
+
+
+def is_region_factor(node):
+    names = expressions.variables(node)
+    return expressions.is_boolean(node) and len(names) > 0 and all(
+        _REGION_BRANCH.match(name) for name in names)
+
+
+class RegionFamily(object):
+    """Selections with the same base factors and different region factors."""
+
+    def __init__(self, base):
+        self._base = base
+        self._regions = []
+        self._index = {}
+
+    @property
+    def base(self):
+        return self._base
+
+    @property
+    def regions(self):
+        return self._regions
+
+    def add(self, region, requests):
+        if not region in self._index:
+            self._index[region] = len(self._regions)
+            self._regions.append((region, []))
+        self._regions[self._index[region]][1].extend(requests)
+
+
+def families(selections):
+    """Group the selections of an event loop into region families."""
+    families = []
+    index = {}
+    for cut, requests in selections:
+        base = []
+        region = []
+        for factor in expressions.factors(expressions.parse(cut)):
+            if is_region_factor(factor):
+                region.append(expressions.to_string(factor))
+            else:
+                base.append(expressions.to_string(factor))
+        base = tuple(sorted(base))
+        if not base in index:
+            index[base] = len(families)
+            families.append(RegionFamily(base))
+        families[index[base]].add(tuple(sorted(region)), requests)
+    return families
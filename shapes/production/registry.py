@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Lazy construction of the processes of a channel.
+
+Processes are registered with a factory and only created on first access,
+so processes of channels which are not produced and processes which are not
+selected are never built.
+"""
+
+from collections import OrderedDict
+import resource
+import time
+
+from .selection import Selection
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ProcessRegistry(object):
+    """Dictionary of processes by nick, created on first access."""
+
+    def __init__(self, selection=None):
+        self._selection = selection or Selection()
+        self._factories = OrderedDict()
+        self._names = {}
+        self._processes = {}
+
+    def register(self, nick, factory, name=None):
+        """Register the factory of a process, named as the nick by default."""
+        self._factories[nick] = factory
+        self._names[nick] = name or nick
+
+    def __setitem__(self, nick, process):
+        """Add a process which is already created."""
+        self._factories[nick] = lambda: process
+        self._names[nick] = process.name
+        self._processes[nick] = process
+
+    def __getitem__(self, nick):
+        if not nick in self._processes:
+            self._processes[nick] = self._factories[nick]()
+        return self._processes[nick]
+
+    def __contains__(self, nick):
+        return nick in self._factories
+
+    def keys(self):
+        return list(self._factories.keys())
+
+    def selected(self, nick):
+        """Whether a process is registered and selected, without creating it."""
+        return nick in self._factories and self._selection.matches(
+            self._names[nick])
+
+    def values(self):
+        """Selected processes in order of registration."""
+        return [self[nick] for nick in self._factories if self.selected(nick)]
+
+    @property
+    def num_created(self):
+        return len(self._processes)
+
+
+class SetupReport(object):
+    """Duration and peak memory of the setup phase."""
+
+    def __init__(self):
+        self._start = time.time()
+
+    def log(self, num_systematics, registries):
+        # The maximum resident set size is given in kB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+        logger.info(
+            "Set up %d systematics from %d of %d registered processes in %.1f s, peak memory %.1f MB.",
+            num_systematics, sum(r.num_created for r in registries),
+            sum(len(r.keys()) for r in registries),
+            time.time() - self._start, peak)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Access to the ROOT objects created by the shape-producer estimation methods.
+
+All knowledge about the internals of shape_producer.histogram is kept in this
+module so that the planner and the backends only deal with plain values.
+"""
+
+import os
+import re
+
+from shape_producer.histogram import Histogram
+
+
+def is_histogram(root_object):
+    return isinstance(root_object, Histogram)
+
+
+def input_files(root_object):
+    return tuple(os.path.expandvars(f) for f in root_object._inputfiles)
+
+
+def folder(root_object):
+    return root_object._folder
+
+
+def friend_files(root_object):
+    friends = getattr(root_object, "_friend_inputfiles_collection", None) or []
+    return tuple(
+        tuple(os.path.expandvars(f) for f in collection)
+        for collection in friends)
+
+
+def cut_string(root_object):
+    return root_object._cuts.expand()
+
+
+def weight_string(root_object):
+    return root_object._weights.extract()
+
+
+def variable_expression(root_object):
+    return root_object._variable.expression
+
+
+def variable_dimensions(root_object):
+    """Dimensions of a multi-dimensional variable or None."""
+    return getattr(root_object._variable, "dimensions", None)
+
+
+def binning_edges(binning):
+    """Return the bin edges of a shape_producer binning as list of floats."""
+    for attribute in ["bins", "_bins"]:
+        bins = getattr(binning, attribute, None)
+        if bins is not None:
+            return [float(b) for b in bins]
+    # ConstantBinning is only available as TTree::Draw string "(n,low,high)"
+    match = re.match(r"^\(\s*(\d+)\s*,([^,]+),([^,]+)\)$",
+                     binning.extract().strip())
+    if match is None:
+        raise Exception(
+            "Cannot extract bin edges from binning {}.".format(binning))
+    nbins = int(match.group(1))
+    low = float(match.group(2))
+    high = float(match.group(3))
+    return [low + (high - low) * i / nbins for i in range(nbins + 1)]
+
+
+def edges(root_object):
+    return binning_edges(root_object._variable.binning)
+
+
+def result(root_object):
+    return root_object._result
+
+
+def set_result(root_object, result):
+    root_object._result = result
+
+
+def create_result(root_object):
+    """Produce the result of a ROOT object on its own, as the classic backend does."""
+    root_object.create_result()
+
+
+def shape_result(shape):
+    return getattr(shape, "_result", None)
+
+
+# Memory of a TH1D besides its bin contents, mostly the axis and the title
+_TH1_OVERHEAD = 1024
+
+
+def histogram_size(nbins):
+    """Memory of a TH1D with sum of weights and squared weights in bytes."""
+    # Two doubles per bin including under- and overflow
+    return 16 * (nbins + 2) + _TH1_OVERHEAD
+
+
+def shape_size(shape):
+    """Memory of the histogram of an estimated shape in bytes."""
+    result = shape_result(shape)
+    if result is None:
+        return 0
+    return histogram_size(result.GetNbinsX())
+
+
+def release(systematic):
+    """Drop the histograms of a systematic after its shape is written."""
+    for root_object in systematic.root_objects:
+        if is_histogram(root_object):
+            root_object._result = None
+    if getattr(systematic, "shape", None) is not None:
+        systematic.shape._result = None
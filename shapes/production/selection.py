@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Selection of names by include and exclude patterns.
+
+Patterns are glob patterns, or regular expressions if prefixed with re:.
+"""
+
+import fnmatch
+import re
+
+
+def _matches(pattern, name):
+    if pattern.startswith("re:"):
+        return re.search(pattern[3:], name) is not None
+    return fnmatch.fnmatchcase(name, pattern)
+
+
+class Selection(object):
+    """Names matching any include pattern, if given, and no exclude pattern."""
+
+    def __init__(self, include=None, exclude=None):
+        self._include = include or []
+        self._exclude = exclude or []
+
+    @property
+    def active(self):
+        return bool(self._include or self._exclude)
+
+    def matches(self, *names):
+        """Whether any of the alternative names of an object is selected."""
+        if self._include and not any(
+                _matches(p, n) for p in self._include for n in names):
+            return False
+        return not any(_matches(p, n) for p in self._exclude for n in names)
+
+    def __str__(self):
+        return "include {}, exclude {}".format(self._include or "all",
+                                               self._exclude or "none")
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Splitting of a shape production into shards and merging of their outputs.
+
+Every shard builds the same list of systematics and selects its part of it
+with a deterministic, cost-balanced assignment. The shards write partial
+shapes files which are merged in the order of the monolithic production.
+"""
+
+import glob
+import json
+import os
+import re
+
+import ROOT
+
+from . import metadata
+from . import root_objects as ro
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(value):
+    """Parse a shard given as i/N with 0 <= i < N."""
+    match = re.match(r"^(\d+)/(\d+)$", value)
+    if match is None or int(match.group(1)) >= int(match.group(2)):
+        raise ValueError("Shard {} is not of the form i/N with i < N.".format(
+            value))
+    return int(match.group(1)), int(match.group(2))
+
+
+def partial_output_file(output_file, index, count):
+    return "{}_shard{}of{}.root".format(
+        os.path.splitext(output_file)[0], index, count)
+
+
+def _index_file(partial_output_file):
+    return os.path.splitext(partial_output_file)[0] + ".json"
+
+
+def _index_files(output_file):
+    """Index files of all shards by shard index and count."""
+    index_files = {}
+    for path in glob.glob("{}_shard*of*.json".format(
+            os.path.splitext(output_file)[0])):
+        match = re.search(r"_shard(\d+)of(\d+)\.json$", path)
+        if match is not None:
+            index_files[(int(match.group(1)), int(match.group(2)))] = path
+    return index_files
+
+
+def start_shard(output_file, index, count):
+    """Remove the index files which would mark outdated shards as complete.
+
+    These are the index of this shard, which is written again once its
+    shapes are complete, and all indices of a different number of shards.
+    """
+    for (i, n), path in _index_files(output_file).items():
+        if n != count or i == index:
+            try:
+                os.remove(path)
+                logger.info("Removed index %s of a previous production.", path)
+            except OSError:
+                pass  # Removed by a concurrent shard
+
+
+class EntriesEstimate(object):
+    """Number of entries of the trees read by the systematics."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def entries(self, path, folder):
+        cache = metadata.shared()
+        if cache is not None:
+            return cache.entries(path, folder)
+        if not (path, folder) in self._entries:
+            rootfile = ROOT.TFile.Open(path)
+            tree = rootfile.Get(folder) if rootfile else None
+            self._entries[(path, folder)] = tree.GetEntries() if tree else 0
+            if rootfile:
+                rootfile.Close()
+        return self._entries[(path, folder)]
+
+    def cost(self, root_objects):
+        """Estimated cost as events times histograms."""
+        cache = metadata.shared()
+        if cache is not None:
+            cache.validate(
+                p for r in root_objects if ro.is_histogram(r)
+                for p in ro.input_files(r))
+        cost = 0
+        for root_object in root_objects:
+            if not ro.is_histogram(root_object):
+                continue
+            folder = ro.folder(root_object)
+            cost += sum(
+                self.entries(path, folder)
+                for path in ro.input_files(root_object))
+        return cost
+
+
+def select_shard(costs, index, count):
+    """Indices of the items of shard index for items with the given costs.
+
+    The items are assigned largest first to the shard with the smallest
+    total cost, which is deterministic for equal inputs.
+    """
+    loads = [0] * count
+    assignment = [[] for _ in range(count)]
+    for i in sorted(range(len(costs)), key=lambda i: (-costs[i], i)):
+        shard = min(range(count), key=lambda s: (loads[s], s))
+        loads[shard] += costs[i]
+        assignment[shard].append(i)
+    logger.info("Estimated cost of shard %d/%d is %.3g (min %.3g, max %.3g).",
+                index, count, loads[index], min(loads), max(loads))
+    return sorted(assignment[index])
+
+
+def write_index(partial_output_file, shard, num_systematics, indices, names):
+    """Record the position of each shape in the monolithic production."""
+    with open(_index_file(partial_output_file), "w") as f:
+        json.dump({
+            "shard": list(shard),
+            "num_systematics": num_systematics,
+            "shapes": [[i, name] for i, name in zip(indices, names)]
+        }, f)
+
+
+def _read_index(path, index, count):
+    with open(path) as f:
+        content = json.load(f)
+    if not isinstance(content, dict) or content.get("shard") != [index, count]:
+        logger.critical("Index %s does not belong to shard %d/%d, produce it again.",
+                        path, index, count)
+        raise Exception
+    return content
+
+
+def merge(output_file):
+    """Merge all partial shapes files of a sharded production."""
+    counts = set(n for _, n in _index_files(output_file))
+    if len(counts) != 1:
+        logger.critical("Found indices of %d sharded productions.",
+                        len(counts))
+        raise Exception
+    count = counts.pop()
+    expected = [partial_output_file(output_file, i, count) for i in range(count)]
+    missing = [p for p in expected if not os.path.exists(_index_file(p))]
+    if missing:
+        logger.critical("Shards are not complete, missing %s.",
+                        ", ".join(missing))
+        raise Exception
+
+    # Collect the shapes of all shards in the order of the monolithic run
+    shapes = []
+    num_systematics = set()
+    for i, partial in enumerate(expected):
+        content = _read_index(_index_file(partial), i, count)
+        num_systematics.add(content["num_systematics"])
+        shapes += [(j, name, partial) for j, name in content["shapes"]]
+    shapes.sort()
+    # Shards of different productions do not add up to a complete one
+    if len(num_systematics) != 1 or [s[0] for s in shapes] != list(
+            range(num_systematics.pop())):
+        logger.critical("Shards do not belong to the same production, produce them again.")
+        raise Exception
+
+    output = ROOT.TFile(output_file, "RECREATE")
+    inputs = dict((p, ROOT.TFile(p)) for p in expected)
+    for _, name, partial in shapes:
+        hist = inputs[partial].Get(name)
+        if not hist:
+            logger.critical("Shape %s is missing in %s.", name, partial)
+            raise Exception
+        output.cd()
+        hist.Write(name)
+    output.Close()
+    for rootfile in inputs.values():
+        rootfile.Close()
+    logger.info("Merged %d shapes of %d shards into %s.", len(shapes), count,
+                output_file)
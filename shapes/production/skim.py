@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped columnar store of the events passing a baseline selection.
+
+The baseline of an event loop consists of the factors shared by the cuts of
+all its requests, which are the channel selection and the common process
+cuts. A skim holds one contiguous array per branch of the events passing
+this baseline. It is identified by the baseline and the paths, sizes and
+modification times of the input files, so changed inputs or cuts lead to a
+new skim. Branches missing in an existing skim are added on demand.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from . import expressions
+from .tree_reader import TreeReader
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def baseline(group):
+    """Factors shared by the cuts of all requests of a group."""
+    factors = None
+    for cut, _ in group.selections():
+        atoms = set(expressions.atoms(cut))
+        factors = atoms if factors is None else factors & atoms
+    return sorted(factors or [])
+
+
+def _write_atomic(path, write):
+    # Concurrent runs never see partially written files
+    handle, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(handle, "wb") as f:
+        write(f)
+    os.rename(temporary, path)
+
+
+class SkimReader(object):
+    """Reads the branches of a skim with the interface of the TreeReader."""
+
+    def __init__(self, directory, num_entries):
+        self._directory = directory
+        self._num_entries = num_entries
+
+    def num_entries(self):
+        return [self._num_entries]
+
+    def iterate(self, branches, chunk_size, start=0, stop=None):
+        arrays = dict((branch, np.load(
+            os.path.join(self._directory, branch + ".npy"), mmap_mode="r"))
+                      for branch in branches)
+        stop = self._num_entries if stop is None else min(
+            stop, self._num_entries)
+        for chunk_start in range(start, stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, stop)
+            yield chunk_stop - chunk_start, dict(
+                (branch, array[chunk_start:chunk_stop])
+                for branch, array in arrays.items())
+
+
+class SkimStore(object):
+    def __init__(self, directory, chunk_size=500000):
+        self._directory = directory
+        self._chunk_size = chunk_size
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _key(self, group, factors):
+        def stat(path):
+            stat = os.stat(path)
+            return [path, stat.st_size, int(stat.st_mtime)]
+
+        content = [
+            factors, group.folder, [stat(f) for f in group.inputfiles],
+            [[stat(f) for f in friend_inputfiles]
+             for friend_inputfiles in group.friend_inputfiles]
+        ]
+        return hashlib.sha1(
+            json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def reader(self, group, branches):
+        """Reader of the skim of a group, skimming missing branches first."""
+        factors = baseline(group)
+        directory = os.path.join(self._directory, self._key(group, factors))
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass  # Created by a concurrent run
+        meta = os.path.join(directory, "skim.json")
+        if os.path.exists(meta):
+            missing = [
+                branch for branch in sorted(branches) if not os.path.exists(
+                    os.path.join(directory, branch + ".npy"))
+            ]
+        else:
+            # Without its number of entries the skim is incomplete, for
+            # example if it was interrupted after writing the arrays
+            missing = sorted(branches)
+        if missing or not os.path.exists(meta):
+            self._skim(group, factors, directory, missing)
+        with open(meta) as f:
+            num_entries = json.load(f)["entries"]
+        return SkimReader(directory, num_entries)
+
+    def _skim(self, group, factors, directory, branches):
+        logger.info("Skim %d branches of %s.", len(branches), group)
+        read = set(branches)
+        for factor in factors:
+            read |= expressions.compiled(factor).branches
+        parts = dict((branch, []) for branch in branches)
+        num_entries = 0
+        reader = TreeReader(group.inputfiles, group.folder,
+                            group.friend_inputfiles)
+        for size, columns in reader.iterate(read, self._chunk_size):
+            mask = np.ones(size, dtype=np.bool_)
+            for factor in factors:
+                mask &= expressions.compiled(factor).evaluate(columns,
+                                                              size) != 0
+            num_entries += int(np.count_nonzero(mask))
+            for branch in branches:
+                parts[branch].append(columns[branch][mask])
+        total = sum(reader.num_entries())
+        for branch in branches:
+            chunks = parts.pop(branch)
+            array = np.concatenate(chunks) if chunks else np.zeros(0)
+            _write_atomic(
+                os.path.join(directory, branch + ".npy"),
+                lambda f: np.save(f, array))
+
+        meta = os.path.join(directory, "skim.json")
+        if not os.path.exists(meta):
+            content = json.dumps({
+                "entries": num_entries,
+                "baseline": factors,
+                "inputfiles": list(group.inputfiles)
+            }).encode("utf-8")
+            _write_atomic(meta, lambda f: f.write(content))
+        logger.info("Skim of %s keeps %d of %d events.", group, num_entries,
+                    total)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+from shape_producer.systematics import Systematics
+
+from .cache import HistogramCache
+from .checkpoint import Checkpoint
+from .planner import FillPlan, group_key
+from .selection import Selection
+from .writer import ShapeWriter
+from . import file_cache
+from . import metadata
+from . import root_objects as ro
+from . import shards
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def create_backend(name,
+                   num_threads,
+                   chunk_size,
+                   num_processes,
+                   task_size,
+                   skim_directory=None):
+    if name == "tdf":
+        if num_processes > 1:
+            logger.warning(
+                "The tdf backend runs in a single process, use the number of threads instead."
+            )
+        if skim_directory is not None:
+            logger.warning("The tdf backend reads the trees without skim.")
+        from .tdf_backend import TDFBackend
+        return TDFBackend(num_threads)
+    if name == "columnar":
+        from .columnar_backend import ColumnarBackend
+        backend = ColumnarBackend(chunk_size, skim_directory)
+        if num_processes > 1:
+            from .process_pool import ProcessPoolBackend
+            backend = ProcessPoolBackend(backend, num_processes, task_size)
+        return backend
+    logger.critical("Backend %s is not implemented.", name)
+    raise Exception
+
+
+class FusedSystematics(Systematics):
+    """Systematics filling all histograms of a tree in a single event loop.
+
+    The classic backend falls back to the shape-producer, which fills each
+    histogram on its own. A shard (index, count) produces only its part of
+    the systematics and writes them to a partial output file. Systematics
+    of processes, categories and variations not selected are not created.
+    The nominal shapes are always kept, as the variations are derived from
+    them.
+    """
+
+    def __init__(self,
+                 output_file,
+                 num_threads=1,
+                 skip_systematic_variations=False,
+                 backend="classic",
+                 chunk_size=500000,
+                 num_processes=1,
+                 task_size=2000000,
+                 cache_directory=None,
+                 cache_size=50e9,
+                 skim_directory=None,
+                 prefetch_size=0,
+                 memory_size=4e9,
+                 resume=False,
+                 shard=None,
+                 processes=None,
+                 categories=None,
+                 variations=None):
+        if shard is not None:
+            shards.start_shard(output_file, *shard)
+            output_file = shards.partial_output_file(output_file, *shard)
+        super(FusedSystematics, self).__init__(
+            output_file,
+            num_threads=num_threads,
+            skip_systematic_variations=skip_systematic_variations)
+        self._fused_output_file = output_file
+        self._fused_num_threads = num_threads
+        self._fused_backend = backend
+        self._fused_chunk_size = chunk_size
+        self._fused_num_processes = num_processes
+        self._fused_task_size = task_size
+        self._fused_skim_directory = skim_directory
+        self._fused_prefetch_size = prefetch_size
+        self._fused_memory_size = memory_size
+        self._resume = resume
+        self._shard = shard
+        self._processes = processes or Selection()
+        self._categories = categories or Selection()
+        self._variations = variations or Selection()
+        self._num_skipped = 0
+        self._cache = None
+        if cache_directory is not None:
+            self._cache = HistogramCache(cache_directory, cache_size)
+
+    @property
+    def num_systematics(self):
+        return len(self._systematics)
+
+    def add(self, systematic):
+        category = systematic.category.name
+        if not self._processes.matches(systematic.process.name) or \
+                not self._categories.matches(category, category.split("_", 1)[-1]):
+            self._num_skipped += 1
+            return
+        super(FusedSystematics, self).add(systematic)
+
+    def add_systematic_variation(self, variation, process, channel, era):
+        if not self._variations.matches(variation.name) or \
+                not self._processes.matches(process.name):
+            return
+        super(FusedSystematics, self).add_systematic_variation(
+            variation=variation, process=process, channel=channel, era=era)
+
+    def _select_shard(self):
+        estimate = shards.EntriesEstimate()
+        costs = []
+        for systematic in self._systematics:
+            systematic.create_root_objects()
+            costs.append(estimate.cost(systematic.root_objects))
+        indices = shards.select_shard(costs, *self._shard)
+        logger.info("Shard %d/%d produces %d of %d systematics.",
+                    self._shard[0], self._shard[1], len(indices),
+                    len(self._systematics))
+        num_systematics = len(self._systematics)
+        self._systematics = [self._systematics[i] for i in indices]
+        return indices, num_systematics
+
+    def produce(self):
+        if self._num_skipped > 0:
+            logger.info("Skipped %d nominal shapes not selected.",
+                        self._num_skipped)
+        if self._shard is not None:
+            indices, num_systematics = self._select_shard()
+        if self._fused_backend == "classic":
+            if self._resume:
+                logger.warning(
+                    "The classic backend does not keep a checkpoint, produce all shapes.")
+            super(FusedSystematics, self).produce()
+        else:
+            self._produce_fused()
+        # The index is written last and marks the shard as complete
+        if self._shard is not None:
+            shards.write_index(self._fused_output_file, self._shard,
+                               num_systematics, indices,
+                               [s.name for s in self._systematics])
+
+    def _produce_fused(self):
+        checkpoint = Checkpoint(self._fused_output_file, self._resume)
+        restored = set()
+        pending = []
+        stale = 0
+        for systematic in self._systematics:
+            logger.debug("Create ROOT objects for systematic %s.",
+                         systematic.name)
+            systematic.create_root_objects()
+            if checkpoint.done(systematic):
+                restored.add(systematic.name)
+                continue
+            if checkpoint.journaled(systematic.name):
+                stale += 1
+            pending.append(systematic)
+        if self._resume:
+            logger.info(
+                "Resume %d of %d systematics from the checkpoint, %d changed since.",
+                len(restored), len(self._systematics), stale)
+
+        backend = create_backend(
+            self._fused_backend, self._fused_num_threads,
+            self._fused_chunk_size, self._fused_num_processes,
+            self._fused_task_size, self._fused_skim_directory)
+        if metadata.shared() is not None:
+            metadata.shared().validate(
+                p for systematic in pending for r in systematic.root_objects
+                if ro.is_histogram(r) for p in ro.input_files(r))
+        # Restored shapes are batched together with the others, so that a
+        # resumed production writes its shapes in the order of a fresh one
+        batches = self._batches(self._systematics, backend, restored)
+        writer = ShapeWriter(self._fused_output_file, self._fused_memory_size,
+                             checkpoint)
+        try:
+            for i, batch in enumerate(batches):
+                logger.info("Produce batch %d/%d of %d systematics.", i + 1,
+                            len(batches), len(batch))
+                root_objects = []
+                for systematic in batch:
+                    if not systematic.name in restored:
+                        root_objects += systematic.root_objects
+                plan = FillPlan(root_objects)
+                plan.summary()
+                plan.fill(backend, self._cache, self._prefetch_size())
+                del plan, root_objects
+                # Shapes are written while the next ones are estimated, and
+                # released before the next batch is filled
+                for systematic in batch:
+                    if systematic.name in restored:
+                        writer.put(checkpoint.restore(systematic.name))
+                        continue
+                    systematic.do_estimation()
+                    writer.put(systematic)
+                writer.wait()
+        finally:
+            writer.close()
+        if self._cache is not None:
+            self._cache.summary()
+            self._cache.evict()
+        if file_cache.shared() is not None:
+            file_cache.shared().summary()
+        checkpoint.remove()
+
+    def _batches(self, systematics, backend, restored=()):
+        """Split the systematics into batches within the memory budget.
+
+        The histograms of a batch are held from the fill until their shapes
+        are written, together with the buffers of the backend such as the
+        shared memory of the process pool. Systematics restored from the
+        checkpoint only hold their shape. Systematics reading the same trees
+        are put next to each other, so that most trees are read in only one
+        batch. The order does not depend on which systematics are restored.
+        """
+        keys = {}
+        sizes = {}
+        for systematic in systematics:
+            histograms = [
+                r for r in systematic.root_objects if ro.is_histogram(r)
+            ]
+            keys[id(systematic)] = sorted(set(group_key(r) for r in histograms))
+            nbins = [len(ro.edges(r)) - 1 for r in histograms]
+            sizes[id(systematic)] = ro.histogram_size(max(nbins or [0]))
+            if systematic.name in restored:
+                continue
+            # The backends hold a copy of each histogram before converting
+            # it to ROOT, and the estimation adds the shape
+            sizes[id(systematic)] += sum(
+                2 * ro.histogram_size(n) + backend.buffer_size(r)
+                for n, r in zip(nbins, histograms))
+        batches = []
+        size = 0
+        for systematic in sorted(systematics, key=lambda s: keys[id(s)]):
+            if not batches or size + sizes[id(systematic)] > self._fused_memory_size:
+                batches.append([])
+                size = 0
+            batches[-1].append(systematic)
+            size += sizes[id(systematic)]
+        if len(batches) > 1:
+            logger.info(
+                "Split %d systematics into %d batches to stay within %.1f MB of histograms.",
+                len(systematics), len(batches), self._fused_memory_size / 1e6)
+        return batches
+
+    def _prefetch_size(self):
+        # Worker processes open their files themselves and skims are read
+        # instead of the input files, so only in-process reads are prefetched
+        if self._fused_backend == "columnar" and (
+                self._fused_num_processes > 1
+                or self._fused_skim_directory is not None):
+            return 0
+        return self._fused_prefetch_size
+
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Fill a group of requests in one event loop using ROOT's RDataFrame."""
+
+from array import array
+
+import ROOT
+
+from . import expressions
+from . import file_cache
+from . import pruning
+from .planner import Backend
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TDFBackend(Backend):
+    name = "tdf"
+
+    def __init__(self, num_threads=1):
+        if num_threads > 1:
+            ROOT.ROOT.EnableImplicitMT(num_threads)
+
+    def _create_chain(self, inputfiles, folder):
+        chain = ROOT.TChain()
+        for inputfile in inputfiles:
+            chain.Add("{}/{}".format(file_cache.local_path(inputfile),
+                                     folder))
+        return chain
+
+    def fill(self, group):
+        chain = self._create_chain(group.inputfiles, group.folder)
+        # Keep references to the friends, the chain does not own them
+        friends = []
+        for friend_inputfiles in group.friend_inputfiles:
+            friend = self._create_chain(friend_inputfiles, group.folder)
+            chain.AddFriend(friend)
+            friends.append(friend)
+        # Read only the branches used by the requests of the group
+        branches = pruning.used_branches(group)
+        if branches is not None:
+            for tree in [chain] + friends:
+                pruning.prune(tree, branches)
+
+        dataframe = ROOT.ROOT.RDataFrame(chain)
+        # The factors of all selections are defined once and evaluated at most
+        # once per event, the selections are products of these columns
+        atoms = {}
+        booked = []
+        for i, (cut, requests) in enumerate(group.selections()):
+            try:
+                factors = expressions.atoms(cut)
+            except ValueError:
+                factors = [cut]
+            for factor in factors:
+                if not factor in atoms:
+                    atoms[factor] = "fused_atom_{}".format(len(atoms))
+                    dataframe = dataframe.Define(
+                        atoms[factor],
+                        "static_cast<double>({})".format(factor))
+            selection = "fused_selection_{}".format(i)
+            dataframe = dataframe.Define(
+                selection, "*".join(atoms[factor] for factor in factors))
+
+            # One filter per selection, the variables and weights of all its
+            # requests are defined on top of it only once per expression
+            node = dataframe.Filter("{} != 0".format(selection))
+            columns = {}
+            for request in requests:
+                # As in TTree::Draw the value of the selection scales the weight
+                weight = "{}*({})".format(selection, request.weight)
+                for expression in [request.expression, weight]:
+                    if not expression in columns:
+                        columns[expression] = "fused_column_{}_{}".format(
+                            i, len(columns))
+                        node = node.Define(columns[expression], expression)
+                model = ROOT.ROOT.RDF.TH1DModel(request.name, request.name,
+                                               len(request.edges) - 1,
+                                               array("d", request.edges))
+                booked.append((request, node.Histo1D(
+                    model, columns[request.expression], columns[weight])))
+
+        # Accessing the first result runs the event loop for all booked histograms
+        for request, result in booked:
+            hist = result.GetValue().Clone(request.name)
+            hist.SetDirectory(0)
+            request.set_result(hist)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Chunked reading of branches from Artus trees into NumPy arrays."""
+
+try:
+    import uproot
+except ImportError:
+    uproot = None
+
+from . import file_cache
+from . import friend_store
+from . import metadata
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _open(path):
+    return uproot.open(file_cache.local_path(path))
+
+
+def num_entries(inputfiles, folder):
+    """Number of entries of a pipeline summed over the input files.
+
+    The counts are taken from the metadata cache if one is configured and
+    read from the original files otherwise.
+    """
+    cache = metadata.shared()
+    if cache is not None:
+        return sum(cache.entries(path, folder) for path in inputfiles)
+    return sum(TreeReader(inputfiles, folder).num_entries())
+
+
+class TreeReader(object):
+    """Reads the branches of a pipeline and its friend trees file by file.
+
+    The friend files are expected in the same order as the input files, which
+    is the layout of the Artus friend tree directories.
+    """
+
+    def __init__(self, inputfiles, folder, friend_inputfiles=()):
+        if uproot is None:
+            logger.critical("Reading trees as arrays requires the uproot package.")
+            raise Exception
+        self._inputfiles = inputfiles
+        self._folder = folder
+        self._friend_inputfiles = friend_inputfiles
+
+    def _open_trees(self, index):
+        trees = [_open(self._inputfiles[index])[self._folder]]
+        for friend_inputfiles in self._friend_inputfiles:
+            path = friend_inputfiles[index]
+            tree = friend_store.open_tree(path, self._folder)
+            if tree is None:
+                tree = _open(path)[self._folder]
+            # Friends are joined to the tree by entry index
+            if tree.numentries != trees[0].numentries:
+                logger.critical("Friend %s/%s has %d instead of %d entries.",
+                                path, self._folder, tree.numentries,
+                                trees[0].numentries)
+                raise Exception
+            trees.append(tree)
+        return trees
+
+    def _assign_branches(self, trees, branches, inputfile):
+        # Each branch is read from the first tree providing it
+        available = [set(tree.keys()) for tree in trees]
+        assignment = [[] for tree in trees]
+        for branch in sorted(branches):
+            for i, names in enumerate(available):
+                if branch.encode("utf-8") in names or branch in names:
+                    assignment[i].append(branch)
+                    break
+            else:
+                logger.critical("Branch %s not found in %s/%s or its friends.",
+                                branch, inputfile, self._folder)
+                raise Exception
+        return assignment
+
+    def num_entries(self):
+        """Number of entries of the pipeline in each input file.
+
+        Only the headers are read, so the original files are opened instead
+        of copying them to the file cache.
+        """
+        return [
+            uproot.open(inputfile)[self._folder].numentries
+            for inputfile in self._inputfiles
+        ]
+
+    def iterate(self, branches, chunk_size, start=0, stop=None):
+        """Yield the number of events and a dictionary of arrays per chunk.
+
+        The entry range from start to stop counts the entries of all input
+        files one after the other.
+        """
+        offset = 0
+        for index, inputfile in enumerate(self._inputfiles):
+            if stop is not None and offset >= stop:
+                break
+            trees = self._open_trees(index)
+            num_entries = trees[0].numentries
+            first = max(start - offset, 0)
+            last = num_entries if stop is None else min(stop - offset,
+                                                         num_entries)
+            offset += num_entries
+            if first >= last:
+                continue
+            assignment = self._assign_branches(trees, branches, inputfile)
+            for chunk_start in range(first, last, chunk_size):
+                chunk_stop = min(chunk_start + chunk_size, last)
+                columns = {}
+                for tree, names in zip(trees, assignment):
+                    if names:
+                        columns.update(
+                            tree.arrays(
+                                names,
+                                entrystart=chunk_start,
+                                entrystop=chunk_stop,
+                                namedecode="utf-8"))
+                yield chunk_stop - chunk_start, columns
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Multi-dimensional variables filled as unrolled one-dimensional histograms.
+
+The bins of all dimensions are numbered with the first dimension running
+fastest, and each event is filled at the centre of its unrolled bin. Events
+outside the range of any dimension go to the overflow bin. The estimation
+methods thus see ordinary histograms, and projections are derived from the
+filled shapes afterwards without another event loop.
+"""
+
+import numpy as np
+
+from shape_producer.binning import VariableBinning
+from shape_producer.variable import Variable
+
+from . import expressions
+
+
+def _number(value):
+    return repr(float(value))
+
+
+def unrolled_expression(dimensions):
+    """TTree::Draw expression of the unrolled bin of the dimensions."""
+    inside = []
+    index = []
+    stride = 1
+    for expression, edges in dimensions:
+        inside.append("(({0}) >= {1}) && (({0}) < {2})".format(
+            expression, _number(edges[0]), _number(edges[-1])))
+        bins = " + ".join("(({}) >= {})".format(expression, _number(edge))
+                          for edge in edges[1:-1]) or "0"
+        index.append("{} * ({})".format(stride, bins))
+        stride *= len(edges) - 1
+    inside = " && ".join(inside)
+    return "({0}) * ({1}) + (!({0})) * {2} + 0.5".format(
+        inside, " + ".join(index), stride)
+
+
+def unrolled_values(dimensions, columns, size):
+    """Values of the unrolled variable evaluated on arrays of columns."""
+    index = np.zeros(size, dtype=np.int64)
+    inside = np.ones(size, dtype=np.bool_)
+    stride = 1
+    for expression, edges in dimensions:
+        values = expressions.compiled(expression).evaluate(columns, size)
+        bins = np.searchsorted(edges, values, side="right") - 1
+        inside &= (bins >= 0) & (bins < len(edges) - 1)
+        index += stride * bins
+        stride *= len(edges) - 1
+    return np.where(inside, index, stride) + 0.5
+
+
+def num_bins(dimensions):
+    return int(np.prod([len(edges) - 1 for _, edges in dimensions]))
+
+
+class NDVariable(Variable):
+    """Variable of several dimensions given as (expression, edges) pairs."""
+
+    def __init__(self, name, dimensions):
+        self.dimensions = tuple((expression, tuple(float(e) for e in edges))
+                                for expression, edges in dimensions)
+        super(NDVariable, self).__init__(
+            name,
+            VariableBinning(list(range(num_bins(self.dimensions) + 1))),
+            expression=unrolled_expression(self.dimensions))
+
+
+def project(sumw, dimensions, axis):
+    """Project the contents of an unrolled histogram on one dimension.
+
+    The contents include under- and overflow. Events outside the range of
+    any dimension are not part of the projection, so its under- and overflow
+    bins are empty.
+    """
+    shape = [len(edges) - 1 for _, edges in dimensions]
+    contents = np.asarray(sumw)[1:num_bins(dimensions) + 1]
+    # The first dimension runs fastest and is the last axis of the array
+    contents = contents.reshape(shape[::-1])
+    other = tuple(i for i in range(len(shape)) if i != len(shape) - 1 - axis)
+    projected = contents.sum(axis=other) if other else contents
+    return np.concatenate([[0.0], projected, [0.0]])
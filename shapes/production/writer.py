@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Writing of the estimated shapes in a background thread.
+
+Systematics are queued as soon as their estimation is done and written by a
+dedicated thread, which releases their histograms afterwards. The queue is
+bounded by the memory of the shapes waiting to be written, so estimation
+blocks while the writer is behind. Written shapes are recorded in the
+checkpoint, if given.
+"""
+
+import threading
+import time
+
+import ROOT
+
+from . import root_objects as ro
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ShapeWriter(object):
+    def __init__(self,
+                 output_file,
+                 max_size,
+                 checkpoint=None,
+                 flush_interval=30.0):
+        self._output_file = output_file
+        self._checkpoint = checkpoint
+        self._max_size = max_size
+        self._flush_interval = flush_interval
+        self._queue = []
+        self._queued_size = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._num_written = 0
+        self._max_queued_size = 0
+        # The output file is opened in the writer thread, which requires
+        # ROOT to keep the current directory per thread
+        ROOT.ROOT.EnableThreadSafety()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, systematic):
+        """Queue a systematic with estimated shape to be written."""
+        size = ro.shape_size(systematic.shape)
+        with self._condition:
+            while (self._queue and self._queued_size + size > self._max_size
+                   and self._error is None):
+                self._condition.wait()
+            self._check()
+            self._queue.append((systematic, size))
+            self._queued_size += size
+            self._max_queued_size = max(self._max_queued_size,
+                                        self._queued_size)
+            self._condition.notify_all()
+
+    def wait(self):
+        """Block until all queued shapes are written."""
+        with self._condition:
+            while self._queue and self._error is None:
+                self._condition.wait()
+            self._check()
+
+    def _run(self):
+        try:
+            output_file = ROOT.TFile(self._output_file, "RECREATE")
+            last_flush = time.time()
+            while True:
+                with self._condition:
+                    while not self._queue and not self._closed:
+                        self._condition.wait()
+                    if not self._queue:
+                        break
+                    systematic, size = self._queue[0]
+                systematic.shape.save(output_file)
+                if self._checkpoint is not None:
+                    self._checkpoint.record(systematic)
+                ro.release(systematic)
+                self._num_written += 1
+                if time.time() - last_flush > self._flush_interval:
+                    output_file.Flush()
+                    last_flush = time.time()
+                with self._condition:
+                    self._queue.pop(0)
+                    self._queued_size -= size
+                    self._condition.notify_all()
+            output_file.Close()
+        except Exception as error:
+            with self._condition:
+                self._error = error
+                self._condition.notify_all()
+
+    def _check(self):
+        if self._error is not None:
+            logger.critical("Writing shapes to %s failed: %s",
+                            self._output_file, self._error)
+            raise Exception
+
+    def close(self):
+        """Write the remaining shapes and close the output file."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._check()
+        logger.info(
+            "Wrote %d shapes to %s with at most %.1f MB waiting in the queue.",
+            self._num_written, self._output_file,
+            self._max_queued_size / 1e6)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True  # disable ROOT internal argument parser
+
+import argparse
+import yaml
+
+from production.histograms import create_th1, from_th1
+from production.unrolling import project
+
+import logging
+logger = logging.getLogger("")
+
+
+def setup_logging(output_file, level=logging.DEBUG):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    file_handler = logging.FileHandler(output_file, "w")
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Project the unrolled shapes of multi-dimensional categories on each of their dimensions."
+    )
+
+    parser.add_argument("input", type=str, help="Path to single input ROOT file.")
+    parser.add_argument("output", type=str, help="Path to output ROOT file.")
+    parser.add_argument(
+        "--binning", required=True, type=str, help="Binning configuration.")
+    return parser.parse_args()
+
+
+def main(args):
+    binning = yaml.load(open(args.binning))
+
+    file_input = ROOT.TFile(args.input)
+    file_output = ROOT.TFile(args.output, "RECREATE")
+    num_projections = 0
+    for key in file_input.GetListOfKeys():
+        name = key.GetName()
+        properties = [x for x in name.split("#") if not x == ""]
+        channel = properties[0]
+        category = properties[1].replace(properties[0] + "_", "", 1)
+        config = binning["categories"].get(channel, {}).get(category, {})
+        if not "dimensions" in config:
+            continue
+
+        # Each projection is written as a category of its own
+        dimensions = [(d["expression"], d["bins"])
+                      for d in config["dimensions"]]
+        _, sumw, sumw2 = from_th1(file_input.Get(name))
+        for axis, dimension in enumerate(config["dimensions"]):
+            name_output = name.replace(
+                "#{}#".format(properties[1]),
+                "#{}_{}#".format(properties[1], dimension["var"]), 1)
+            hist = create_th1(name_output, dimension["bins"],
+                              project(sumw, dimensions, axis),
+                              project(sumw2, dimensions, axis))
+            file_output.cd()
+            hist.Write()
+            num_projections += 1
+    file_output.Close()
+    file_input.Close()
+    logger.info("Wrote %d projections.", num_projections)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging("project_shapes.log", logging.INFO)
+    main(args)
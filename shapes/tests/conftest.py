@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# The production package is imported from the shapes directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip("ROOT")
+pytest.importorskip("shape_producer")
+
+from shape_producer.histogram import Histogram
+
+from production import root_objects as ro
+from production import tree_reader
+from production.columnar_backend import ColumnarBackend
+from production.process_pool import ProcessPoolBackend
+from production.systematics import FusedSystematics
+
+
+class Binning(object):
+    bins = [0.0, 1.0, 2.0]
+
+
+class Variable(object):
+    expression = "m_vis"
+    binning = Binning()
+
+
+class FakeHistogram(Histogram):
+    def __init__(self, inputfile, folder):
+        self._inputfiles = [inputfile]
+        self._folder = folder
+        self._variable = Variable()
+
+
+class FakeSystematic(object):
+    def __init__(self, name, inputfile, folder):
+        self.name = name
+        self.root_objects = [FakeHistogram(inputfile, folder)]
+
+
+def batches(backend, memory_size, restored=()):
+    systematics = FusedSystematics.__new__(FusedSystematics)
+    systematics._fused_memory_size = memory_size
+    names = [("a", "f1", "x"), ("b", "f2", "x"), ("c", "f1", "x"),
+             ("d", "f1", "y")]
+    return [[s.name for s in batch]
+            for batch in systematics._batches(
+                [FakeSystematic(*n) for n in names], backend, restored)]
+
+
+def test_batches_group_trees():
+    size = 3 * ro.histogram_size(2)
+    assert batches(ColumnarBackend(), 2.5 * size) == [["a", "c"],
+                                                       ["d", "b"]]
+    assert batches(ColumnarBackend(), 1e9) == [["a", "c", "d", "b"]]
+
+
+def test_batches_count_shared_memory_of_process_pool(monkeypatch):
+    monkeypatch.setattr(tree_reader, "num_entries", lambda files, folder: 1000)
+    backend = ProcessPoolBackend(ColumnarBackend(), 4, task_size=10)
+    # 100 tasks with sums of weights, squared weights and the entries
+    buffer_size = 8 * (2 * 4 + 1) * 100
+    assert backend.buffer_size(FakeHistogram("f1", "x")) == buffer_size
+    size = 3 * ro.histogram_size(2)
+    assert batches(ColumnarBackend(), 4 * size) == [["a", "c", "d", "b"]]
+    assert batches(backend, 4 * size) == [["a"], ["c"], ["d"], ["b"]]
+    assert batches(backend, 2 * (size + buffer_size)) == [["a", "c"],
+                                                          ["d", "b"]]
+
+
+def test_restored_systematics_keep_their_order(monkeypatch):
+    monkeypatch.setattr(tree_reader, "num_entries", lambda files, folder: 1000)
+    backend = ProcessPoolBackend(ColumnarBackend(), 4, task_size=10)
+    size = 3 * ro.histogram_size(2) + 8 * (2 * 4 + 1) * 100
+    fresh = batches(backend, 2 * size)
+    resumed = batches(backend, 2 * size, set(["a", "c", "d"]))
+    # Restored systematics only hold their shape and share a batch
+    assert resumed == [["a", "c", "d", "b"]]
+    assert sum(resumed, []) == sum(fresh, [])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+
+import pytest
+
+pytest.importorskip("shape_producer")
+
+from production import datasets
+
+DATABASE = {
+    "DY1": {"process": "DY1JetsToLL", "campaign": "Fall17",
+            "generator": "madgraph"},
+    "DY2": {"process": "DY2JetsToLL", "campaign": "Fall17",
+            "generator": "madgraph"},
+    "TT": {"process": "TTTo2L2Nu", "campaign": "Fall17",
+           "generator": "powheg"},
+    "DY1ext": {"process": "DY1JetsToLL", "campaign": "Fall17",
+               "generator": "madgraph", "xsec": "1.0"},
+    "DY1old": {"process": "DY1JetsToLL", "campaign": "Summer16",
+               "generator": "madgraph"},
+}
+
+
+class Helper(object):
+    """Datasets helper matching regular expressions as the shape-producer."""
+
+    constructed = 0
+
+    def __init__(self, path):
+        type(self).constructed += 1
+        with open(path) as f:
+            self.base_dict = json.load(f)
+
+    def get_nicks_with_query(self, query):
+        return [
+            nick for nick in self.base_dict if all(
+                re.match(query[k], self.base_dict[nick].get(k, ""))
+                for k in query)
+        ]
+
+
+@pytest.fixture
+def database(tmpdir, monkeypatch):
+    monkeypatch.setattr(datasets, "_base", {"class": Helper, "directory": None})
+    Helper.constructed = 0
+    path = str(tmpdir.join("datasets.json"))
+    with open(path, "w") as f:
+        json.dump(DATABASE, f)
+    return path
+
+
+def test_queries_match_helper(database):
+    indexed = datasets.IndexedDatasetsHelper(database)
+    helper = Helper(database)
+    for query in [{"process": "DY.*", "campaign": "Fall17"},
+                  {"generator": "madgraph"}, {"xsec": "1"}]:
+        assert indexed.get_nicks_with_query(query) == \
+            helper.get_nicks_with_query(query)
+
+
+def test_index_is_loaded_from_sidecar(database):
+    first = datasets.IndexedDatasetsHelper(database)
+    second = datasets.IndexedDatasetsHelper(database)
+    assert Helper.constructed == 1
+    assert second._index == first._index
+    assert second.get_nicks_with_query({"process": "DY1.*"}) == [
+        "DY1", "DY1ext", "DY1old"
+    ]
+
+
+def test_corrupt_sidecar_is_rebuilt(database):
+    with open(database + ".index.pkl", "wb") as f:
+        f.write(b"corrupt")
+    indexed = datasets.IndexedDatasetsHelper(database)
+    assert Helper.constructed == 1
+    assert indexed.get_nicks_with_query({"process": "TT.*"}) == ["TT"]
+    datasets.IndexedDatasetsHelper(database)
+    assert Helper.constructed == 1
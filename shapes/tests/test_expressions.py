@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from production import expressions
+
+
+def evaluate(expression, **columns):
+    size = len(list(columns.values())[0]) if columns else 1
+    columns = dict(
+        (k, np.asarray(v, dtype=np.float64)) for k, v in columns.items())
+    return expressions.compiled(expression).evaluate(columns, size)
+
+
+def test_branches():
+    assert sorted(expressions.branches("(pt_1>25)*abs(eta_2)+TMath::Pi")) == [
+        "eta_2", "pt_1"
+    ]
+
+
+def test_boolean_arithmetic():
+    a = [1.0, -1.0, 1.0, -1.0]
+    b = [1.0, 1.0, -1.0, -1.0]
+    assert np.array_equal(evaluate("(a>0)+(b>0)", a=a, b=b), [2, 1, 1, 0])
+    assert np.array_equal(evaluate("(a>0)-(b>0)", a=a, b=b), [0, -1, 1, 0])
+    assert np.array_equal(evaluate("(a>0)*(b>0)", a=a, b=b), [1, 0, 0, 0])
+    assert np.array_equal(evaluate("-(a>0)", a=a), [-1, 0, -1, 0])
+
+
+def test_logical_and_ternary():
+    x = [0.0, 1.0, 2.0, 3.0]
+    assert np.array_equal(evaluate("(x>0)&&(x<3)", x=x), [0, 1, 1, 0])
+    assert np.array_equal(evaluate("(x<1)||!(x<3)", x=x), [1, 0, 0, 1])
+    assert np.array_equal(evaluate("x>1 ? 2*x : -1", x=x), [-1, -1, 4, 6])
+
+
+def test_division_and_functions():
+    x = [1.0, 4.0, 9.0]
+    assert np.allclose(evaluate("sqrt(x)/2", x=x), [0.5, 1.0, 1.5])
+    assert np.allclose(evaluate("max(x, 3.0)", x=x), [3.0, 4.0, 9.0])
+    assert np.allclose(evaluate("x % 4", x=x), [1.0, 0.0, 1.0])
+
+
+def test_modulo_of_integers():
+    x = [7.9, 5.5, -7.9, 2.4]
+    assert np.array_equal(evaluate("x % 2.5", x=x), [1.0, 1.0, -1.0, 0.0])
+    assert np.array_equal(evaluate("x % 3", x=x), [1.0, 2.0, -1.0, 2.0])
+
+
+def test_constant_is_broadcast():
+    columns = {"x": np.zeros(5)}
+    assert np.array_equal(
+        expressions.compiled("1.0").evaluate(columns, 5), np.ones(5))
+
+
+def test_atoms():
+    atoms = expressions.atoms("(pt_1>25)*(q_1*q_2<0)*(iso_1<0.15)")
+    assert atoms == ["(pt_1 > 25)", "((q_1 * q_2) < 0)", "(iso_1 < 0.15)"]
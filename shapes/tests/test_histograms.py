@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+pytest.importorskip("ROOT")
+
+from production import histograms
+
+
+def test_fill_includes_under_and_overflow():
+    edges = np.array([0.0, 1.0, 2.0])
+    values = np.array([-1.0, 0.0, 0.5, 1.0, 2.0, 3.0])
+    weights = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    sumw, sumw2 = histograms.fill(edges, values, weights)
+    assert np.array_equal(sumw, [1.0, 5.0, 4.0, 11.0])
+    assert np.array_equal(sumw2, [1.0, 13.0, 16.0, 61.0])
+
+
+def test_fill_stacked_matches_fill():
+    rng = np.random.RandomState(1)
+    edges = np.linspace(0.0, 1.0, 6)
+    values = rng.rand(100) * 1.2 - 0.1
+    weights = rng.rand(100)
+    regions = rng.randint(0, 3, 100)
+    sumw, sumw2 = histograms.fill_stacked(edges, regions, 3, values, weights)
+    for region in range(3):
+        mask = regions == region
+        expected = histograms.fill(edges, values[mask], weights[mask])
+        assert np.allclose(sumw[region], expected[0])
+        assert np.allclose(sumw2[region], expected[1])
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+pytest.importorskip("ROOT")
+
+from production import metadata
+
+
+def fake_read(path):
+    return path, {
+        "stat": metadata._stat(path)[1],
+        "entries": {"mt_nominal/ntuple": 5, "mt_tauEsUp/ntuple": 3},
+        "generator_weights": 4.5
+    }
+
+
+def test_entries_trees_and_generator_weights(tmpdir, monkeypatch):
+    monkeypatch.setattr(metadata, "read", fake_read)
+    path = str(tmpdir.join("a.root"))
+    tmpdir.join("a.root").write("x")
+    cache = metadata.MetadataCache(str(tmpdir.join("metadata.json")))
+    assert cache.entries(path, "mt_nominal") == 5
+    assert cache.entries(path, "mt_tauEsUp/ntuple") == 3
+    assert cache.entries(path, "et_nominal") == 0
+    assert cache.trees(path) == ["mt_nominal/ntuple", "mt_tauEsUp/ntuple"]
+    assert cache.generator_weights(path) == 4.5
+
+
+def test_entries_without_generator_weights_are_read_again(tmpdir, monkeypatch):
+    monkeypatch.setattr(metadata, "read", fake_read)
+    path = str(tmpdir.join("a.root"))
+    tmpdir.join("a.root").write("x")
+    with open(str(tmpdir.join("metadata.json")), "w") as f:
+        json.dump({
+            "files": {
+                path: {
+                    "stat": metadata._stat(path)[1],
+                    "entries": {"mt_nominal/ntuple": 1}
+                }
+            }
+        }, f)
+    cache = metadata.MetadataCache(str(tmpdir.join("metadata.json")))
+    assert cache.generator_weights(path) == 4.5
+    assert cache.entries(path, "mt_nominal") == 5
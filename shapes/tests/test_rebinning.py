@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+pytest.importorskip("ROOT")
+
+from production import rebinning
+
+
+def test_subdivide():
+    assert rebinning.subdivide([0.0, 1.0, 3.0], 2) == [0.0, 0.5, 1.0, 2.0, 3.0]
+    assert rebinning.subdivide([0.0, 1.0], 1) == [0.0, 1.0]
+
+
+def test_rebin_moves_outer_bins_to_under_and_overflow():
+    edges = [0.0, 1.0, 2.0, 3.0, 4.0]
+    contents = np.array([[10.0, 1.0, 2.0, 3.0, 4.0, 20.0]])
+    rebinned = rebinning.rebin(edges, contents, [1.0, 3.0])
+    assert np.array_equal(rebinned, [[11.0, 5.0, 24.0]])
+
+
+def test_target_must_be_subset():
+    with pytest.raises(ValueError):
+        rebinning.target_indices([0.0, 1.0, 2.0], [2.0, 1.0])
+
+
+def test_optimize_merges_until_requirements_hold():
+    edges = [0.0, 1.0, 2.0, 3.0, 4.0]
+    background = np.array([0.0, 2.0, 2.0, 0.5, 0.5, 0.0])
+    sumw2 = np.array([0.0, 0.1, 0.1, 0.1, 0.1, 0.0])
+    optimized = rebinning.optimize(edges, background[None, :], background,
+                                   sumw2, 1.0, 1.0)
+    assert optimized == [0.0, 1.0, 2.0, 4.0]
+
+
+def test_optimize_merges_empty_templates():
+    edges = [0.0, 1.0, 2.0]
+    background = np.array([0.0, 5.0, 5.0, 0.0])
+    templates = np.array([background, [0.0, 0.0, 1.0, 0.0]])
+    optimized = rebinning.optimize(edges, templates, background,
+                                   background * 0.01, 1.0, 1.0)
+    assert optimized == [0.0, 2.0]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+pytest.importorskip("ROOT")
+pytest.importorskip("shape_producer")
+
+from production import shards
+
+
+def write_index(output_file, index, count, num_systematics, indices):
+    partial = shards.partial_output_file(output_file, index, count)
+    shards.write_index(partial, (index, count), num_systematics, indices,
+                       ["shape{}".format(i) for i in indices])
+    return os.path.splitext(partial)[0] + ".json"
+
+
+def test_start_shard_removes_outdated_indices(tmpdir):
+    output_file = str(tmpdir.join("x_shapes.root"))
+    own = write_index(output_file, 0, 2, 4, [0, 1])
+    other = write_index(output_file, 1, 2, 4, [2, 3])
+    stale = write_index(output_file, 2, 3, 4, [3])
+    shards.start_shard(output_file, 0, 2)
+    assert not os.path.exists(own)
+    assert os.path.exists(other)
+    assert not os.path.exists(stale)
+
+
+def test_merge_rejects_shards_of_different_productions(tmpdir, caplog):
+    output_file = str(tmpdir.join("x_shapes.root"))
+    write_index(output_file, 0, 2, 4, [0, 1])
+    write_index(output_file, 1, 2, 5, [2, 3, 4])
+    with pytest.raises(Exception):
+        shards.merge(output_file)
+    assert "not belong to the same production" in caplog.text
+
+
+def test_merge_rejects_index_of_another_shard(tmpdir, caplog):
+    output_file = str(tmpdir.join("x_shapes.root"))
+    write_index(output_file, 0, 2, 4, [0, 1])
+    path = write_index(output_file, 1, 2, 4, [2, 3])
+    with open(path, "w") as f:
+        json.dump([[2, "shape2"], [3, "shape3"]], f)
+    with pytest.raises(Exception):
+        shards.merge(output_file)
+    assert "does not belong to shard 1/2" in caplog.text
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+pytest.importorskip("shape_producer")
+
+from production import expressions
+from production import unrolling
+
+DIMENSIONS = (("x", (0.0, 1.0, 2.0)), ("y", (0.0, 10.0, 20.0, 30.0)))
+
+
+def test_values_and_expression_agree():
+    columns = {
+        "x": np.array([0.5, 1.5, 0.5, 1.5, -1.0, 0.5]),
+        "y": np.array([5.0, 5.0, 25.0, 15.0, 5.0, 35.0])
+    }
+    values = unrolling.unrolled_values(DIMENSIONS, columns, 6)
+    assert np.array_equal(values, [0.5, 1.5, 4.5, 3.5, 6.5, 6.5])
+    expression = unrolling.unrolled_expression(DIMENSIONS)
+    assert np.array_equal(
+        expressions.compiled(expression).evaluate(columns, 6), values)
+
+
+def test_project():
+    # Unrolled contents with under- and overflow, first dimension fastest
+    sumw = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0])
+    assert np.array_equal(
+        unrolling.project(sumw, DIMENSIONS, 0), [0.0, 9.0, 12.0, 0.0])
+    assert np.array_equal(
+        unrolling.project(sumw, DIMENSIONS, 1), [0.0, 3.0, 7.0, 11.0, 0.0])
+    assert unrolling.num_bins(DIMENSIONS) == 6